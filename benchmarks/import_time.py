@@ -0,0 +1,93 @@
+"""Check that importing test_utils, and getting the runner going, stay quick.
+
+Each import is timed in a fresh interpreter, against the example project's
+settings, once Django's settings are loaded. We also check that importing
+doesn't drag in optional or backend-specific modules (jinja2, selenium,
+celery, MySQLdb...) which only some tests need. Run it from the repo root::
+
+    python benchmarks/import_time.py [--runs N] [--budget-ms MS]
+        [--runner-budget-ms MS]
+
+It exits non-zero if an import goes over budget or loads something it
+shouldn't, so it can guard CI.
+
+"""
+import json
+import optparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLE = os.path.join(ROOT, 'examples', 'test-utils')
+
+# Modules which importing test_utils or its runner mustn't load:
+OPTIONAL = ['MySQLdb', 'django.db.backends.mysql.creation', 'jinja2',
+            'selenium', 'celery', 'async_signals',
+            'test_utils.compiled_fixtures', 'test_utils.snapshots',
+            'test_utils.fixture_tables']
+
+_PROBE = '''
+import sys, time
+import django.conf; django.conf.settings.INSTALLED_APPS
+start = time.time()
+%s
+elapsed = time.time() - start
+import json
+print (json.dumps({'ms': elapsed * 1000,
+                   'loaded': [m for m in %r if m in sys.modules]}))
+'''
+
+SNIPPETS = {
+    'test_utils': 'import test_utils',
+    'runner': 'from test_utils.runner import RadicalTestSuiteRunner\n'
+              'RadicalTestSuiteRunner(verbosity=0)',
+}
+
+
+def probe(snippet):
+    """Run ``snippet`` in a fresh interpreter, and return how long it took
+    and which of the OPTIONAL modules it loaded."""
+    env = dict(os.environ,
+               DJANGO_SETTINGS_MODULE='settings',
+               PYTHONPATH=os.pathsep.join([ROOT, EXAMPLE,
+                                           os.environ.get('PYTHONPATH', '')]))
+    output = subprocess.Popen([sys.executable, '-c',
+                               _PROBE % (snippet, OPTIONAL)],
+                              stdout=subprocess.PIPE, cwd=EXAMPLE,
+                              env=env).communicate()[0]
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--runs', type='int', default=5)
+    parser.add_option('--budget-ms', type='float', default=300,
+                      help='Budget for "import test_utils"')
+    parser.add_option('--runner-budget-ms', type='float', default=500,
+                      help='Budget for importing and making the runner')
+    options, args = parser.parse_args()
+
+    budgets = {'test_utils': options.budget_ms,
+               'runner': options.runner_budget_ms}
+    failed = False
+    for name in ['test_utils', 'runner']:
+        results = [probe(SNIPPETS[name]) for i in range(options.runs)]
+        ms = median(r['ms'] for r in results)
+        loaded = sorted(set().union(*[r['loaded'] for r in results]))
+        over = ms > budgets[name]
+        failed = failed or over or bool(loaded)
+        print ('%-12s %8.1f ms (budget %s ms)%s' %
+               (name, ms, budgets[name], '  OVER BUDGET' if over else ''))
+        if loaded:
+            print ('%-12s loaded %s' % ('', ', '.join(loaded)))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+"""Measure what test_utils' test cases and runner cost, on a synthetic project.
+
+A throwaway app is generated with as many models, fixture files and fixture
+rows as asked for, and tested against SQLite the way
+``examples/test-utils/settings.py`` sets things up. We time:
+
+* runner startup: ``RadicalTestSuiteRunner.setup_databases`` in a fresh
+  process, both creating the test DB and reusing it,
+* fixture loading: ``setUpClass``,
+* per-test overhead: ``_pre_setup`` and ``_post_teardown`` (the rollback)
+  around a test which writes one row,
+* class teardown: ``tearDownClass`` (the truncation),
+
+for ``TransactionTestCase``, ``FastFixtureTestCase`` and ``TestCase``. The
+results are written as JSON so runs before and after a change can be
+compared. Run it from the repo root::
+
+    python benchmarks/overhead.py --tables 50 --rows 20 --fixtures 5 \\
+        --output after.json --compare before.json
+
+"""
+import json
+import optparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def make_project(path, tables, rows, fixtures):
+    """Write an app called ``benchapp`` under ``path`` with ``tables`` models
+    and ``fixtures`` fixture files holding ``rows`` rows of each model
+    between them."""
+    app = os.path.join(path, 'benchapp')
+    os.makedirs(os.path.join(app, 'fixtures'))
+    open(os.path.join(app, '__init__.py'), 'w').close()
+    with open(os.path.join(app, 'models.py'), 'w') as f:
+        f.write('from django.db import models\n')
+        for i in range(tables):
+            f.write('\n\nclass Table%s(models.Model):\n'
+                    '    name = models.CharField(max_length=50)\n'
+                    '    value = models.IntegerField()\n' % i)
+    for n in range(fixtures):
+        objects = [{'model': 'benchapp.table%s' % i, 'pk': pk,
+                    'fields': {'name': 'row %s' % pk, 'value': pk}}
+                   for i in range(tables)
+                   for pk in range(n + 1, rows + 1, fixtures)]
+        with open(os.path.join(app, 'fixtures', 'bench_%s.json' % n),
+                  'w') as f:
+            json.dump(objects, f)
+
+
+def configure(path):
+    sys.path.insert(0, path)
+    from django.conf import settings
+    settings.configure(
+        DATABASES={
+            'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': os.path.join(path, 'bench.db'),
+                # Otherwise the test DB is in memory and can't be reused:
+                'TEST_NAME': os.path.join(path, 'test_bench.db'),
+            }
+        },
+        INSTALLED_APPS=('django_nose', 'benchapp'),
+        TEST_RUNNER='test_utils.runner.RadicalTestSuiteRunner')
+
+
+def startup():
+    """Print how long the runner takes to import and set up the DBs."""
+    start = time.time()
+    from test_utils.runner import RadicalTestSuiteRunner
+    imported = time.time()
+    runner = RadicalTestSuiteRunner(verbosity=0, interactive=False)
+    runner.setup_test_environment()
+    runner.setup_databases()
+    print (json.dumps({'import_ms': (imported - start) * 1000,
+                       'setup_databases_ms':
+                           (time.time() - imported) * 1000}))
+
+
+def time_startup(path, force):
+    env = dict(os.environ, FORCE_DB='1' if force else '0')
+    output = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--startup', path],
+        stdout=subprocess.PIPE, env=env).communicate()[0]
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def stats(timings):
+    timings = sorted(timings)
+    return {'mean_ms': sum(timings) / len(timings) * 1000,
+            'median_ms': timings[len(timings) // 2] * 1000,
+            'count': len(timings)}
+
+
+def time_case(base, fixtures, classes, tests):
+    """Return timings of each phase of ``classes`` subclasses of ``base``
+    with ``tests`` tests each."""
+    from benchapp import models
+
+    def test_write(self):
+        models.Table0.objects.create(name='written', value=0)
+
+    phases = {'setup_class': [], 'test': [], 'teardown_class': []}
+    for c in range(classes):
+        cls = type('Bench%s%s' % (base.__name__, c), (base,),
+                   {'fixtures': fixtures, 'test_write': test_write,
+                    '__module__': __name__})
+        start = time.time()
+        cls.setUpClass()
+        phases['setup_class'].append(time.time() - start)
+        for t in range(tests):
+            test = cls('test_write')
+            start = time.time()
+            test._pre_setup()
+            test.test_write()
+            test._post_teardown()
+            phases['test'].append(time.time() - start)
+        start = time.time()
+        cls.tearDownClass()
+        phases['teardown_class'].append(time.time() - start)
+    return dict((phase, stats(t)) for phase, t in phases.items())
+
+
+def compare(results, path):
+    """Print how ``results`` differ from the ones saved at ``path``."""
+    with open(path) as f:
+        old = json.load(f)['results']
+    for case in sorted(results):
+        for phase in sorted(results[case]):
+            before = old.get(case, {}).get(phase)
+            now = results[case][phase]
+            if not before:
+                continue
+            for key in sorted(now):
+                if key == 'count' or not before.get(key):
+                    continue
+                print ('%-20s %-15s %-16s %9.3f -> %9.3f (%+.1f%%)' %
+                       (case, phase, key, before[key], now[key],
+                        (now[key] / before[key] - 1) * 100))
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--tables', type='int', default=20)
+    parser.add_option('--rows', type='int', default=10,
+                      help='Rows per table')
+    parser.add_option('--fixtures', type='int', default=3,
+                      help='Fixture files to spread the rows over')
+    parser.add_option('--classes', type='int', default=5)
+    parser.add_option('--tests', type='int', default=20,
+                      help='Tests per class')
+    parser.add_option('--output', help='Where to write the JSON results')
+    parser.add_option('--compare', help='JSON results to compare against')
+    parser.add_option('--startup', help=optparse.SUPPRESS_HELP)
+    options, args = parser.parse_args()
+
+    if options.startup:
+        configure(options.startup)
+        startup()
+        return
+
+    path = tempfile.mkdtemp()
+    try:
+        make_project(path, options.tables, options.rows, options.fixtures)
+        results = {'runner': {'cold': time_startup(path, True),
+                              'warm': time_startup(path, False)}}
+
+        configure(path)
+        from test_utils import (FastFixtureTestCase, TestCase,
+                                TransactionTestCase)
+        from test_utils.runner import RadicalTestSuiteRunner
+        runner = RadicalTestSuiteRunner(verbosity=0, interactive=False)
+        runner.setup_test_environment()
+        runner.setup_databases()
+        fixtures = ['bench_%s' % n for n in range(options.fixtures)]
+        for base in [TransactionTestCase, FastFixtureTestCase, TestCase]:
+            results[base.__name__] = time_case(base, fixtures,
+                                               options.classes,
+                                               options.tests)
+
+        import django
+        report = {'params': dict((k, getattr(options, k)) for k in
+                                 ['tables', 'rows', 'fixtures', 'classes',
+                                  'tests']),
+                  'django': django.get_version(),
+                  'python': sys.version.split()[0],
+                  'results': results}
+        if options.output:
+            with open(options.output, 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+        else:
+            print (json.dumps(report, indent=2, sort_keys=True))
+        if options.compare:
+            compare(results, options.compare)
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Compare test_utils' truncation engine against the old one-DELETE-per-table
+teardown on a local SQLite database.
+
+Each simulated test writes a few rows to a few tables out of many, then tears
+down. Run it from the repo root::
+
+    python benchmarks/truncation.py [tables] [dirty tables] [rows] [tests]
+
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from django.conf import settings
+
+TEMP_DIR = tempfile.mkdtemp()
+settings.configure(DATABASES={
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(TEMP_DIR, 'bench.db'),
+    }
+})
+
+from django.db import connection, transaction
+
+from test_utils.truncation import truncate_tables
+
+
+def make_tables(count):
+    cursor = connection.cursor()
+    tables = ['bench_%s' % i for i in xrange(count)]
+    for table in tables:
+        cursor.execute('CREATE TABLE %s (id INTEGER PRIMARY KEY, '
+                       'value VARCHAR(50))' % table)
+    transaction.commit_unless_managed()
+    return tables
+
+
+def dirty(tables, rows):
+    cursor = connection.cursor()
+    for table in tables:
+        cursor.executemany('INSERT INTO %s (value) VALUES (%%s)' % table,
+                           [('row %s' % i,) for i in xrange(rows)])
+    transaction.commit_unless_managed()
+
+
+def old_teardown(tables):
+    # What TransactionTestCase used to do on anything but MySQL:
+    cursor = connection.cursor()
+    for table in tables:
+        cursor.execute('DELETE FROM %s' % table)
+    transaction.commit_unless_managed()
+
+
+def new_teardown(tables):
+    truncate_tables(connection, tables)
+
+
+def bench(teardown, tables, dirty_count, rows, tests):
+    """Return the mean seconds spent in teardown per test."""
+    spent = 0
+    for i in xrange(tests):
+        dirty(tables[i % len(tables):][:dirty_count], rows)
+        start = time.time()
+        teardown(tables)
+        spent += time.time() - start
+    return spent / tests
+
+
+def main(table_count=200, dirty_count=3, rows=20, tests=50):
+    tables = make_tables(table_count)
+    old = bench(old_teardown, tables, dirty_count, rows, tests)
+    new = bench(new_teardown, tables, dirty_count, rows, tests)
+    print ('%s tables, %s dirtied per test with %s rows each, %s tests' %
+           (table_count, dirty_count, rows, tests))
+    print ('DELETE per table: %8.3f ms per test' % (old * 1000))
+    print ('truncate_tables:  %8.3f ms per test' % (new * 1000))
+    print ('saving:           %8.3f ms per test' % ((old - new) * 1000))
+
+
+if __name__ == '__main__':
+    try:
+        main(*map(int, sys.argv[1:]))
+    finally:
+        shutil.rmtree(TEMP_DIR)
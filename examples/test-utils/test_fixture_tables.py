@@ -0,0 +1,27 @@
+from StringIO import StringIO
+
+from nose.tools import eq_
+
+from test_utils.fixture_tables import _xml_models
+
+
+M2M_FIXTURE = """<?xml version="1.0" encoding="utf-8"?>
+<django-objects version="1.0">
+  <object pk="1" model="auth.user">
+    <field type="CharField" name="username">jbalogh</field>
+    <field to="auth.group" name="groups" rel="ManyToManyRel">
+      <object pk="1"></object>
+      <object pk="2"></object>
+    </field>
+  </object>
+  <object pk="1" model="auth.group">
+    <field type="CharField" name="name">admins</field>
+    <field to="auth.permission" name="permissions" rel="ManyToManyRel">
+    </field>
+  </object>
+</django-objects>
+"""
+
+
+def test_xml_models_skips_m2m_objects():
+    eq_(list(_xml_models(StringIO(M2M_FIXTURE))), ['auth.user', 'auth.group'])
@@ -1,26 +1,30 @@
+# Only what the classes below are built on is imported up front. Modules
+# needed only once fixtures are loaded or an optional feature is used, and
+# optional dependencies like jinja2 and selenium, are imported where they're
+# used, so importing test_utils (and picking a single test to run) is quick.
+# See benchmarks/import_time.py.
+import pkgutil
+
 from django import test
 from django.conf import settings
-from django.core import cache, management, mail
+from django.core import management, mail
 from django.core.management import call_command
 from django.db import connection, connections, DEFAULT_DB_ALIAS, transaction
-from django.db.models import loading
 from django.test.client import RequestFactory as DjangoRequestFactory
-from django.utils.encoding import smart_unicode as unicode
-from django.utils.translation import trans_real
-from django.utils.translation.trans_real import to_language
-
-from nose.tools import eq_
-from nose import SkipTest
 
 from . import signals
-from test_utils.fixture_tables import tables_used_by_fixtures
-from test_utils.runner import uses_mysql
+from test_utils.caching import class_boundary, isolate_cache
+from test_utils.templates import instrument_jinja
+from test_utils.timing import timed
+from test_utils.translations import reset_translations
+from test_utils.dirty import tracker_for
+from test_utils.layers import (drop_layer, enter_layer, exit_layer,
+                               method_fixtures)
+from test_utils.queries import query_budget, QueryCapture, within_budget
+from test_utils.truncation import truncate_tables
 
-HAS_JINJA2 = True
-try:
-    import jinja2
-except ImportError:
-    HAS_JINJA2 = False
+# Found without importing it:
+HAS_JINJA2 = pkgutil.find_loader('jinja2') is not None
 
 
 VERSION = (0, 3)
@@ -29,6 +33,13 @@ __version__ = '.'.join(map(str, VERSION))
 # We only want to run through setup_test_environment once.
 IS_SETUP = False
 TEST_UTILS_NO_TRUNCATE = set(getattr(settings, 'TEST_UTILS_NO_TRUNCATE', ()))
+TEST_UTILS_TRACK_DIRTY_TABLES = getattr(settings,
+                                        'TEST_UTILS_TRACK_DIRTY_TABLES',
+                                        False)
+TEST_UTILS_FIXTURE_SNAPSHOTS = getattr(settings,
+                                       'TEST_UTILS_FIXTURE_SNAPSHOTS', False)
+TEST_UTILS_COMPILED_FIXTURES = getattr(settings,
+                                       'TEST_UTILS_COMPILED_FIXTURES', False)
 
 
 def setup_test_environment():
@@ -38,16 +49,7 @@ def setup_test_environment():
         return
     IS_SETUP = True
 
-    if HAS_JINJA2:
-        old_render = jinja2.Template.render
-
-        def instrumented_render(self, *args, **kwargs):
-            context = dict(*args, **kwargs)
-            test.signals.template_rendered.send(sender=self, template=self,
-                                                context=context)
-            return old_render(self, *args, **kwargs)
-
-        jinja2.Template.render = instrumented_render
+    instrument_jinja()
 
     try:
         from celery.app import current_app
@@ -69,14 +71,16 @@ class BaseTestCase(object):
         setup_test_environment()
         super(BaseTestCase, self).__init__(*args, **kwargs)
 
+    @timed('pre_setup')
     def _pre_setup(self):
         # allow others to prepare
         signals.pre_setup.send(sender=self.__class__)
-        cache.cache.clear()
+        isolate_cache()
         settings.CACHE_COUNT_TIMEOUT = None
         settings.TEMPLATE_DEBUG = settings.DEBUG = False
         super(BaseTestCase, self)._pre_setup()
 
+    @timed('post_teardown')
     def _post_teardown(self):
         super(BaseTestCase, self)._post_teardown()
         # allow others to clean up
@@ -107,19 +111,22 @@ class TransactionTestCase(BaseTestCase, test.TransactionTestCase):
                                         **{'verbosity': 0, 'database': db})
 
     def _fixture_teardown(self):
-        """Executes a quick truncation of MySQL tables."""
-        cursor = connection.cursor()
-        using_mysql = uses_mysql(connection)
-        if using_mysql:
-            cursor.execute('SET FOREIGN_KEY_CHECKS=0')
-        table = connection.introspection.django_table_names()
-        for table in set(table) - TEST_UTILS_NO_TRUNCATE:
-            if using_mysql:
-                cursor.execute('TRUNCATE `%s`' % table)
-            else:
-                cursor.execute('DELETE FROM %s' % table)
+        """Quickly empty the tables, using the best method for the backend.
+
+        With ``TEST_UTILS_TRACK_DIRTY_TABLES`` on, only tables written to
+        since the last teardown are emptied, unless some query was too exotic
+        for us to tell which tables it touched.
 
-        cursor.close()
+        """
+        tables = (set(connection.introspection.django_table_names()) -
+                  TEST_UTILS_NO_TRUNCATE)
+        if TEST_UTILS_TRACK_DIRTY_TABLES:
+            tracker = tracker_for(connection.alias)
+            tables = tracker.tables_to_empty(tables)
+        truncate_tables(connection, tables)
+        if TEST_UTILS_TRACK_DIRTY_TABLES:
+            # Our own truncations don't count:
+            tracker.reset()
 
 
 class FastFixtureTestCase(test.TransactionTestCase):
@@ -138,17 +145,26 @@ class FastFixtureTestCase(test.TransactionTestCase):
     Note that this is like Django's TestCase, not its TransactionTestCase, in
     that you cannot do your own commits or rollbacks from within tests.
 
+    A test can have more fixtures loaded just for it, on top of the class's,
+    by decorating it with ``method_fixtures``. Those are rolled back to a
+    savepoint after the test rather than reloaded, so consecutive tests with
+    the same method fixtures load them once.
+
     For best speed, group tests using the same fixtures into as few classes as
-    possible. Better still, don't do that, and instead use the fixture-bundling
-    plugin from django-nose, which does it dynamically at test time.
+    possible. Better still, don't do that, and instead run
+    ``RadicalTestSuiteRunner`` with ``--with-bundle-fixtures`` (or use the
+    fixture-bundling plugin from django-nose), which does it dynamically at
+    test time.
 
     """
     @classmethod
+    @timed('setup_class')
     def setUpClass(cls):
         """Turn on manual commits. Load and commit the fixtures."""
         if not test.testcases.connections_support_transactions():
             raise NotImplementedError('%s supports only DBs with transaction '
                                       'capabilities.' % cls.__name__)
+        class_boundary()
         for db in cls._databases():
             # These MUST be balanced with one leave_* each:
             transaction.enter_transaction_management(using=db)
@@ -158,9 +174,13 @@ class FastFixtureTestCase(test.TransactionTestCase):
         cls._fixture_setup()
 
     @classmethod
+    @timed('teardown_class')
     def tearDownClass(cls):
         """Truncate the world, and turn manual commit management back off."""
+        for db in cls._databases():
+            drop_layer(db)
         cls._fixture_teardown()
+        class_boundary()
         for db in cls._databases():
             # Finish off any transactions that may have happened in
             # tearDownClass in a child method.
@@ -170,19 +190,55 @@ class FastFixtureTestCase(test.TransactionTestCase):
 
     @classmethod
     def _fixture_setup(cls):
-        """Load fixture data, and commit."""
+        """Load fixture data, and commit.
+
+        If ``TEST_UTILS_FIXTURE_SNAPSHOTS`` is on, the data is copied back
+        from a snapshot taken the last time these fixtures were loaded, if
+        there is one, rather than loaded again. Otherwise, if
+        ``TEST_UTILS_COMPILED_FIXTURES`` is on, the fixtures are loaded in
+        bulk from their compiled form.
+
+        """
         for db in cls._databases():
+            writes = None
             if (hasattr(cls, 'fixtures') and cls.fixtures and
                 getattr(cls, '_fb_should_setup_fixtures', True)):
                 # Iff the fixture-bundling test runner tells us we're the first
                 # suite having these fixtures, set them up:
-                call_command('loaddata', *cls.fixtures, **{'verbosity': 0,
-                                                           'commit': False,
-                                                           'database': db})
+                if TEST_UTILS_FIXTURE_SNAPSHOTS:
+                    from test_utils.dirty import recording_writes
+                    from test_utils.fixture_tables import (
+                        tables_used_by_fixtures)
+                    from test_utils.snapshots import (empty_tables,
+                                                      restore_snapshot)
+                    if not restore_snapshot(cls.fixtures, db):
+                        empty = empty_tables(db, tables_used_by_fixtures(
+                            cls.fixtures, using=db))
+                        with recording_writes(db) as writes:
+                            cls._load_fixtures(db)
+                else:
+                    cls._load_fixtures(db)
             # No matter what, to preserve the effect of cursor start-up
             # statements...
             transaction.commit(using=db)
 
+            # Snapshot every table loaddata wrote to, unless some statement
+            # was too weird for us to be sure which those were, or some of
+            # those tables had rows already, which aren't the fixtures':
+            if writes and not writes.everything and writes.tables <= empty:
+                from test_utils.snapshots import take_snapshot
+                take_snapshot(cls.fixtures, db, writes.tables)
+
+    @classmethod
+    def _load_fixtures(cls, db):
+        from test_utils.compiled_fixtures import load_compiled_fixtures
+        if not (TEST_UTILS_COMPILED_FIXTURES and
+                load_compiled_fixtures(cls.fixtures, db)):
+            call_command('loaddata', *cls.fixtures,
+                         **{'verbosity': 0,
+                            'commit': False,
+                            'database': db})
+
     @classmethod
     def _fixture_teardown(cls):
         """Empty (only) the tables we loaded fixtures into, then commit."""
@@ -190,43 +246,38 @@ class FastFixtureTestCase(test.TransactionTestCase):
            getattr(cls, '_fb_should_teardown_fixtures', True):
             # If the fixture-bundling test runner advises us that the next test
             # suite is going to reuse these fixtures, don't tear them down.
+            from test_utils.compiled_fixtures import compiled_tables
+            from test_utils.fixture_tables import tables_used_by_fixtures
             for db in cls._databases():
-                tables = tables_used_by_fixtures(cls.fixtures, using=db)
+                tables = None
+                if TEST_UTILS_COMPILED_FIXTURES:
+                    # Free, if we've compiled them:
+                    tables = compiled_tables(cls.fixtures, db)
+                if tables is None:
+                    tables = tables_used_by_fixtures(cls.fixtures, using=db)
                 # TODO: Think about respecting _meta.db_tablespace, not just
                 # db_table.
-                if tables:
-                    connection = connections[db]
-                    cursor = connection.cursor()
-
-                    # TODO: Rather than assuming that anything added to by a
-                    # fixture can be emptied, remove only what the fixture
-                    # added. This would probably solve input.mozilla.com's
-                    # failures (since worked around) with Site objects; they
-                    # were loading additional Sites with a fixture, and then
-                    # the Django-provided example.com site was evaporating.
-                    if uses_mysql(connection):
-                        cursor.execute('SET FOREIGN_KEY_CHECKS=0')
-                        for table in tables:
-                            # Truncate implicitly commits.
-                            cursor.execute('TRUNCATE `%s`' % table)
-                        # TODO: necessary?
-                        cursor.execute('SET FOREIGN_KEY_CHECKS=1')
-                    else:
-                        for table in tables:
-                            cursor.execute('DELETE FROM %s' % table)
-
+                # TODO: Rather than assuming that anything added to by a
+                # fixture can be emptied, remove only what the fixture added.
+                # This would probably solve input.mozilla.com's failures
+                # (since worked around) with Site objects; they were loading
+                # additional Sites with a fixture, and then the
+                # Django-provided example.com site was evaporating.
+                truncate_tables(connections[db], tables)
                 transaction.commit(using=db)
-                # cursor.close()  # Should be unnecessary, since we committed
-                # any environment-setup statements that come with opening a new
-                # cursor when we committed the fixtures.
 
+    @timed('pre_setup')
     def _pre_setup(self):
-        """Disable transaction methods, and clear some globals."""
+        """Load method fixtures, disable transaction methods, and clear some
+        globals."""
         # Repeat stuff from TransactionTestCase, because I'm not calling its
         # _pre_setup, because that would load fixtures again.
-        cache.cache.clear()
+        isolate_cache()
         settings.TEMPLATE_DEBUG = settings.DEBUG = False
 
+        method = getattr(self, self._testMethodName, None)
+        self._layer_savepoints = enter_layer(
+            getattr(method, 'method_fixtures', None), self._databases())
         test.testcases.disable_transaction_methods()
 
         self.client = self.client_class()
@@ -238,17 +289,18 @@ class FastFixtureTestCase(test.TransactionTestCase):
         from django.contrib.sites.models import Site
         Site.objects.clear_cache()
 
+    @timed('post_teardown')
     def _post_teardown(self):
         """Re-enable transaction methods, and roll back any changes.
 
         Rollback clears any DB changes made by the test so the original fixture
-        data is again visible.
+        data is again visible. Method fixtures are rolled back only as far as
+        the savepoint taken after loading them, if the DB has savepoints.
 
         """
         # Rollback any mutations made by tests:
         test.testcases.restore_transaction_methods()
-        for db in self._databases():
-            transaction.rollback(using=db)
+        exit_layer(self._layer_savepoints)
 
         self._urlconf_teardown()
 
@@ -276,26 +328,50 @@ class TestCase(FastFixtureTestCase):
         * A cache-machine timeout
         * On-thread celery execution
         * Deactivation of any l10n locales
+        * Query budgets
+
+    Set ``query_budget`` to fail any test which runs more queries than that,
+    and ``query_repeat_limit`` to fail any which runs the same query, give or
+    take its parameters, more times than that (the N+1 problem). Use the
+    ``query_budget`` decorator to set either for a single test method. To
+    look at the queries yourself, use ``capture_queries()``::
+
+        with self.capture_queries() as queries:
+            self.client.get('/')
+        print queries.summary()
 
     """
+    query_budget = None
+    query_repeat_limit = None
+
     def __init__(self, *args, **kwargs):
         setup_test_environment()
         super(TestCase, self).__init__(*args, **kwargs)
 
+    @timed('pre_setup')
     def _pre_setup(self):
         """Adjust cache-machine settings, and send custom pre-setup signal."""
         signals.pre_setup.send(sender=self.__class__)
         settings.CACHE_COUNT_TIMEOUT = None
-        trans_real.deactivate()
-        trans_real._translations = {}  # Django fails to clear this cache.
-        trans_real.activate(settings.LANGUAGE_CODE)
+        # Django fails to clear its cache of translations, but reloading them
+        # all is slow, so restore them to how they were first loaded:
+        reset_translations()
         super(TestCase, self)._pre_setup()
+        method = getattr(self, self._testMethodName)
+        setattr(self, self._testMethodName, within_budget(self, method))
 
+    @timed('post_teardown')
     def _post_teardown(self):
         """Send custom post-teardown signal."""
+        self.__dict__.pop(self._testMethodName, None)
         super(TestCase, self)._post_teardown()
         signals.post_teardown.send(sender=self.__class__)
 
+    def capture_queries(self):
+        """Return a context manager which records the queries run against
+        this test's DBs."""
+        return QueryCapture(self._databases())
+
 
 class ExtraAppTestCase(FastFixtureTestCase):
     """
@@ -311,44 +387,34 @@ class ExtraAppTestCase(FastFixtureTestCase):
     extra_apps = []
 
     @classmethod
+    @timed('setup_class')
     def setUpClass(cls):
+        from test_utils.extra_apps import create_app_tables, install_app
         for app in cls.extra_apps:
-            settings.INSTALLED_APPS += (app,)
-            loading.load_app(app)
-        management.call_command('syncdb', verbosity=0, interactive=False)
+            install_app(app)
+        for db in cls._databases():
+            create_app_tables(cls.extra_apps, db)
         super(ExtraAppTestCase, cls).setUpClass()
 
     @classmethod
+    @timed('teardown_class')
     def tearDownClass(cls):
         # Remove the apps from extra_apps.
-        for app_label in cls.extra_apps:
-            app_name = app_label.split('.')[-1]
-            app = loading.cache.get_app(app_name)
-            try:
-                # Django <= 1.6.
-                del loading.cache.app_models[app_name]
-            except AttributeError:
-                # Django 1.7+.
-                del loading.cache.all_models[app_name]
-            try:
-                # Django <= 1.6.
-                del loading.cache.app_store[app]
-            except AttributeError:
-                pass
-
-        apps = set(settings.INSTALLED_APPS).difference(cls.extra_apps)
-        settings.INSTALLED_APPS = tuple(apps)
+        from test_utils.extra_apps import uninstall_app
+        for app in cls.extra_apps:
+            uninstall_app(app)
         super(ExtraAppTestCase, cls).tearDownClass()
 
 
-try:
-    # You don't need a SeleniumTestCase if you don't have selenium.
-    from selenium import selenium
-
+# You don't need a SeleniumTestCase if you don't have selenium.
+if pkgutil.find_loader('selenium') is not None:
     class SeleniumTestCase(TestCase):
         selenium = True
 
         def setUp(self):
+            from nose import SkipTest
+            from selenium import selenium
+
             super(SeleniumTestCase, self).setUp()
 
             if not settings.SELENIUM_CONFIG:
@@ -364,8 +430,6 @@ try:
             self.selenium.close()
             self.selenium.stop()
             super(SeleniumTestCase, self).tearDown()
-except ImportError:
-    pass
 
 
 class RequestFactory(DjangoRequestFactory):
@@ -394,10 +458,14 @@ class RequestFactory(DjangoRequestFactory):
 
 def locale_eq(a, b):
     """Compare two locales."""
+    from django.utils.translation.trans_real import to_language
+    from nose.tools import eq_
     eq_(*map(to_language, [a, b]))
 
 
 def trans_eq(translation, string, locale=None):
+    from django.utils.encoding import smart_unicode as unicode
+    from nose.tools import eq_
     eq_(unicode(translation), string)
     if locale:
         locale_eq(translation.locale, locale)
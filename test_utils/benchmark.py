@@ -0,0 +1,318 @@
+"""Benchmark views without a server, and fail tests when they get slower.
+
+Each view is called over and over with requests made by ``RequestFactory``,
+and every call's DB changes are rolled back, as ``FastFixtureTestCase`` does
+after each test, so every call sees the same data::
+
+    from test_utils.benchmark import assert_no_regressions, benchmark_views
+
+    def test_speed(self):
+        results = benchmark_views([
+            (views.home, ('get', '/')),
+            (views.search, ('get', '/search', {'q': 'firefox'})),
+            (views.detail, ('get', '/addon/3615'), {'addon_id': 3615}),
+        ], runs=200, threads=4)
+        assert_no_regressions(results, 'benchmarks.json')
+
+A request is a (method, path, ...) tuple of arguments for ``RequestFactory``
+or a callable which is passed a ``RequestFactory`` and returns a request. A
+fresh request is made for every call, and making it isn't timed.
+
+With ``threads``, each thread uses its own DB connections, so the test DB must
+be one other connections can see: not an in-memory SQLite DB, and not
+uncommitted fixtures.
+
+"""
+import json
+import math
+import os
+import re
+import threading
+from time import time
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS, transaction
+from django.test import testcases
+
+from test_utils import RequestFactory
+from test_utils.queries import QueryCapture
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+# Statements for the savepoint each call gets inside a test, which aren't the
+# view's queries:
+_SAVEPOINT = re.compile(r'\s*(SAVEPOINT|RELEASE|ROLLBACK\s+TO)\b', re.I)
+
+
+def percentile(sorted_values, p):
+    """Return the ``p``th percentile of ``sorted_values`` by nearest rank."""
+    if not sorted_values:
+        return None
+    rank = int(math.ceil(p / 100.0 * len(sorted_values))) - 1
+    return sorted_values[max(0, min(rank, len(sorted_values) - 1))]
+
+
+class ViewBenchmark(object):
+    """How a view fared: ``latencies`` (sorted, in seconds), ``wall`` (the
+    seconds all the runs took together), ``queries`` (the total number run)
+    and ``allocations`` (peak bytes allocated during one call, or None before
+    Python 3.4, which has no ``tracemalloc``)."""
+
+    def __init__(self, name, latencies, wall, queries, allocations):
+        self.name = name
+        self.latencies = sorted(latencies)
+        self.wall = wall
+        self.queries = queries
+        self.allocations = allocations
+
+    @property
+    def runs(self):
+        return len(self.latencies)
+
+    @property
+    def p50(self):
+        return percentile(self.latencies, 50)
+
+    @property
+    def p95(self):
+        return percentile(self.latencies, 95)
+
+    @property
+    def p99(self):
+        return percentile(self.latencies, 99)
+
+    @property
+    def throughput(self):
+        """Calls per second."""
+        return self.runs / self.wall if self.wall else None
+
+    @property
+    def queries_per_run(self):
+        return float(self.queries) / self.runs if self.runs else 0
+
+    def as_dict(self):
+        return {'runs': self.runs, 'p50': self.p50, 'p95': self.p95,
+                'p99': self.p99, 'throughput': self.throughput,
+                'queries': self.queries_per_run,
+                'allocations': self.allocations}
+
+    def __str__(self):
+        return ('%s: p50 %.2f ms, p95 %.2f ms, p99 %.2f ms, %.1f/s, '
+                '%.1f queries' % (self.name, self.p50 * 1000,
+                                  self.p95 * 1000, self.p99 * 1000,
+                                  self.throughput or 0,
+                                  self.queries_per_run))
+
+
+def _name(view, request):
+    name = '%s.%s' % (view.__module__, getattr(view, '__name__',
+                                               view.__class__.__name__))
+    if not callable(request):
+        name += ' %s %s' % (request[0].upper(), request[1])
+    return name
+
+
+def _make_request(factory, request):
+    if callable(request):
+        return request(factory)
+    method, args = request[0], request[1:]
+    return getattr(factory, method.lower())(*args)
+
+
+def _call(view, request, kwargs, factory):
+    """Return how long one call of ``view`` took."""
+    request = _make_request(factory, request)
+    start = time()
+    view(request, **kwargs)
+    return time() - start
+
+
+def _isolated(aliases, calls, f, nested=False):
+    """Run ``f`` ``calls`` times, each in a transaction which is rolled back,
+    and return its results.
+
+    If ``nested``, we're inside a test's transaction, which mustn't be rolled
+    back, so each call gets a savepoint instead. On DBs without savepoints,
+    those calls see each other's changes.
+
+    """
+    results = []
+    if nested:
+        for i in range(calls):
+            savepoints = dict((db, transaction.savepoint(using=db))
+                              for db in aliases)
+            try:
+                results.append(f())
+            finally:
+                for db, sid in savepoints.items():
+                    transaction.savepoint_rollback(sid, using=db)
+                    transaction.savepoint_commit(sid, using=db)
+        return results
+
+    for db in aliases:
+        testcases.real_enter_transaction_management(using=db)
+        testcases.real_managed(True, using=db)
+    try:
+        for i in range(calls):
+            try:
+                results.append(f())
+            finally:
+                for db in aliases:
+                    testcases.real_rollback(using=db)
+    finally:
+        for db in aliases:
+            testcases.real_leave_transaction_management(using=db)
+    return results
+
+
+def _allocations(aliases, f, nested):
+    if tracemalloc is None:
+        return None
+    tracemalloc.start()
+    try:
+        _isolated(aliases, 1, f, nested)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _threaded(aliases, runs, threads, f):
+    """Spread ``runs`` calls of ``f`` over ``threads`` threads, and return
+    all their results."""
+    results = []
+    errors = []
+
+    def work(calls):
+        try:
+            results.extend(_isolated(aliases, calls, f))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            for db in aliases:
+                connections[db].close()
+
+    workers = [threading.Thread(target=work,
+                                args=(runs // threads +
+                                      (1 if i < runs % threads else 0),))
+               for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    if errors:
+        raise errors[0]
+    return results
+
+
+def benchmark_views(cases, runs=100, warmup=10, threads=1, using=None):
+    """Call each view in ``cases`` ``runs`` times and return a
+    ``ViewBenchmark`` for each, in order.
+
+    ``cases`` holds (view, request) or (view, request, kwargs) tuples, where
+    ``kwargs`` are passed to the view as if from the URLconf. The first
+    ``warmup`` calls of each view aren't counted. Calls are made from
+    ``threads`` threads at once. Changes to the DBs in ``using`` (by default
+    just the default DB) are rolled back after every call, and views can't
+    commit them.
+
+    """
+    aliases = list(using or [DEFAULT_DB_ALIAS])
+    factory = RequestFactory()
+
+    # Inside a test case, the transaction methods are off already.
+    disable = transaction.commit is testcases.real_commit
+    nested = not disable
+    if disable:
+        testcases.disable_transaction_methods()
+    try:
+        results = []
+        for case in cases:
+            view, request = case[:2]
+            kwargs = case[2] if len(case) > 2 else {}
+
+            def call():
+                return _call(view, request, kwargs, factory)
+
+            _isolated(aliases, warmup, call, nested)
+            allocations = _allocations(aliases, call, nested)
+            with QueryCapture(aliases) as capture:
+                start = time()
+                if threads > 1:
+                    latencies = _threaded(aliases, runs, threads, call)
+                else:
+                    latencies = _isolated(aliases, runs, call, nested)
+                wall = time() - start
+            queries = len([q for q in capture.queries
+                           if not _SAVEPOINT.match(q[1])])
+            results.append(ViewBenchmark(_name(view, request), latencies,
+                                         wall, queries, allocations))
+        return results
+    finally:
+        if disable:
+            testcases.restore_transaction_methods()
+
+
+# Baselines
+
+def load_baselines(path):
+    """Return the baselines saved at ``path``, keyed by view name."""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baselines(results, path):
+    """Save ``results`` as the baselines at ``path``, keeping those of views
+    not among them."""
+    baselines = load_baselines(path)
+    baselines.update((r.name, r.as_dict()) for r in results)
+    with open(path, 'w') as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+
+
+def regressions(results, baselines, threshold):
+    """Return a message for each way ``results`` are worse than
+    ``baselines``: a p95 latency or allocation more than ``threshold`` (a
+    fraction) higher, or any more queries."""
+    problems = []
+    for result in results:
+        baseline = baselines.get(result.name)
+        if not baseline:
+            continue
+        for key, allowed in [('p95', threshold), ('allocations', threshold),
+                             ('queries', 0)]:
+            before, now = baseline.get(key), result.as_dict()[key]
+            if before is None or now is None:
+                continue
+            if now > before * (1 + allowed) + 1e-9:
+                problems.append('%s: %s went from %s to %s' %
+                                (result.name, key, before, now))
+    return problems
+
+
+def assert_no_regressions(results, path, threshold=None):
+    """Fail if ``results`` have regressed past the baselines at ``path``.
+
+    Views without baselines get them saved. Set
+    ``TEST_UTILS_BENCHMARK_UPDATE`` to save all of them afresh instead of
+    comparing.
+
+    """
+    if threshold is None:
+        threshold = getattr(settings, 'TEST_UTILS_BENCHMARK_THRESHOLD', 0.25)
+    baselines = load_baselines(path)
+    if getattr(settings, 'TEST_UTILS_BENCHMARK_UPDATE', False):
+        save_baselines(results, path)
+        return
+    problems = regressions(results, baselines, threshold)
+    if problems:
+        raise AssertionError('Views got slower than their baselines:\n' +
+                             '\n'.join(problems))
+    new = [r for r in results if r.name not in baselines]
+    if new:
+        save_baselines(new, path)
@@ -0,0 +1,130 @@
+"""A nose plugin which runs test classes sharing fixtures back to back, so
+each distinct set of fixtures is loaded and torn down only once.
+
+It bundles together the ``FastFixtureTestCase`` subclasses with identical
+sets of ``fixtures``, and advises the first class in each bundle to set the
+fixtures up and the last to tear them down, through the
+``_fb_should_setup_fixtures`` and ``_fb_should_teardown_fixtures`` attributes.
+Bundles with overlapping fixtures are put next to each other, too. Classes
+only share a bundle if they agree about ``multi_db`` as well. Classes
+with ``exempt_from_fixture_bundling = True`` still get bundled, but only with
+each other, and set up and tear down for themselves.
+
+Enable it with ``--with-bundle-fixtures``. It stands aside when tests are
+spread across ``--processes``, since the classes of one bundle could end up in
+different workers.
+
+"""
+from nose.plugins import Plugin
+from nose.suite import ContextSuite
+
+import test_utils
+
+
+def _is_subclass_at_all(cls, class_info):
+    """Return whether ``cls`` is a subclass of ``class_info``.
+
+    Even if ``cls`` is not a class, don't crash. Return False instead.
+
+    """
+    try:
+        return issubclass(cls, class_info)
+    except TypeError:
+        return False
+
+
+def _flatten(suite, process):
+    """Traverse a nested mess of suites down to the first level that has
+    setup or teardown routines, and call ``process`` on each suite there.
+
+    Going all the way down to the Tests would cut them off from their classes'
+    setUpClass and tearDownClass, which is where fixtures get loaded.
+
+    """
+    if (not hasattr(suite, '_tests') or
+        (hasattr(suite, 'hasFixtures') and suite.hasFixtures())):
+        process(suite)
+    else:
+        for test in suite._tests:
+            _flatten(test, process)
+
+
+def _failed(bundle):
+    """Return whether any class in ``bundle`` failed last time, according to
+    the history plugin."""
+    return any(getattr(suite.context, '_failed_last_time', False)
+               for suite in bundle)
+
+
+def _ordered(buckets):
+    """Return the keys of ``buckets`` ordered so that each fixture set is
+    followed by the one it overlaps with most.
+
+    Starts with the biggest bundle, and gets greedy from there. Bundles with
+    classes which failed last time go before all the others, though, for
+    ``--failed-first``.
+
+    """
+    remaining = sorted(buckets, key=lambda k: (-len(buckets[k]), sorted(k[0])))
+    ordered = []
+    while remaining:
+        candidates = ([k for k in remaining if _failed(buckets[k])] or
+                      remaining)
+        if ordered:
+            current = ordered[-1][0]
+            best = max(candidates, key=lambda k: len(k[0] & current))
+        else:
+            best = candidates[0]
+        remaining.remove(best)
+        ordered.append(best)
+    return ordered
+
+
+class FixtureBundlingPlugin(Plugin):
+    """Reorder test classes so shared fixtures are loaded only once."""
+    name = 'bundle-fixtures'
+    # nose keeps the first suite a prepareTest returns, so go before
+    # django-nose's TestReorderer (100), but after the history plugin (200):
+    score = 150
+
+    def configure(self, options, conf):
+        super(FixtureBundlingPlugin, self).configure(options, conf)
+        if (getattr(options, 'multiprocess_workers', 0) or 0) > 0:
+            self.enabled = False
+        self.saved = 0
+
+    def prepareTest(self, test):
+        # { (frozenset(['users.json']), multi_db?, exempt?):
+        #       [ContextSuite, ...] }
+        buckets = {}
+        # Everything that isn't a FastFixtureTestCase, in the order it came:
+        remainder = []
+
+        def bucket(suite):
+            context = getattr(suite, 'context', None)
+            if _is_subclass_at_all(context, test_utils.FastFixtureTestCase):
+                key = (frozenset(getattr(context, 'fixtures', None) or []),
+                       getattr(context, 'multi_db', False),
+                       getattr(context, 'exempt_from_fixture_bundling', False))
+                buckets.setdefault(key, []).append(suite)
+            else:
+                remainder.append(suite)
+        _flatten(test, bucket)
+
+        flattened = []
+        for key in _ordered(buckets):
+            (fixtures, multi_db, exempt), bundle = key, buckets[key]
+            if fixtures and not exempt:
+                for i, suite in enumerate(bundle):
+                    suite.context._fb_should_setup_fixtures = i == 0
+                    suite.context._fb_should_teardown_fixtures = (
+                        i == len(bundle) - 1)
+                self.saved += sum(len(list(suite.context._databases()))
+                                  for suite in bundle[1:])
+            flattened.extend(bundle)
+        flattened.extend(remainder)
+        return ContextSuite(flattened)
+
+    def report(self, stream):
+        stream.writeln('Fixture bundling saved %s loaddata calls.' %
+                       self.saved)
@@ -0,0 +1,53 @@
+"""Keep tests from seeing each other's cached data.
+
+By default, the cache is cleared before every test. With
+``TEST_UTILS_CACHE_ISOLATION = True``, each test instead gets a fresh cache
+key version, which costs one attribute assignment however big or slow the
+cache is. Stale versions are reclaimed by a real clear at class boundaries, or
+after ``TEST_UTILS_CACHE_FLUSH_EVERY`` tests, whichever comes first. Keys
+stored with an explicit ``version`` aren't isolated, of course.
+
+"""
+from django.conf import settings
+from django.core import cache
+
+
+# The cache's own default version, before we started bumping it:
+_base_version = None
+
+# How many versions we've been through since the last real clear:
+_generation = 0
+
+
+def _isolating():
+    return getattr(settings, 'TEST_UTILS_CACHE_ISOLATION', False)
+
+
+def flush_cache():
+    """Really clear the cache, reclaiming any stale versions."""
+    global _base_version, _generation
+    if _base_version is not None:
+        cache.cache.version = _base_version
+    _generation = 0
+    cache.cache.clear()
+
+
+def isolate_cache():
+    """Make sure the coming test doesn't see anything cached before it."""
+    global _base_version, _generation
+    if not _isolating():
+        cache.cache.clear()
+        return
+    if _base_version is None:
+        _base_version = cache.cache.version
+    if _generation >= getattr(settings, 'TEST_UTILS_CACHE_FLUSH_EVERY', 100):
+        flush_cache()
+    _generation += 1
+    cache.cache.version = _base_version + _generation
+
+
+def class_boundary():
+    """Note that a test class is starting or finishing, which is a good time
+    to reclaim stale versions."""
+    if _isolating() and _generation:
+        flush_cache()
@@ -0,0 +1,255 @@
+"""Fixtures precompiled into a compact binary form which loads with one
+``executemany`` per table rather than a ``save()`` per object.
+
+The first time a set of fixtures is wanted, it's deserialized as usual, and
+the field values of each model are stored as rows of plain Python values,
+pickled and compressed, under ``TEST_UTILS_COMPILED_FIXTURE_DIR``. The file is
+named after a hash of the fixture labels, the fixture files' contents, and the
+schema, so editing a fixture or a model just means compiling again. Since
+unpickling a file can run any code, compiled fixtures are only loaded from
+files, and directories, which are ours and which nobody else can write to.
+
+Loading a compiled fixture replaces any existing rows with the same primary
+keys, the way loaddata does, but doesn't send ``pre_save`` or ``post_save``
+signals. Fixtures which can't be compiled ahead of time, such as ones with
+natural keys, which are looked up in whatever the DB holds at the time, fall
+back to loaddata.
+
+"""
+import cPickle as pickle
+import hashlib
+import os
+import stat
+import tempfile
+import zlib
+
+from django.conf import settings
+from django.core import serializers
+from django.core.management.color import no_style
+from django.db import connections, router
+from django.db.models import get_model
+
+from test_utils.fixture_tables import (content_hash, find_fixture_files,
+                                       open_fixture)
+from test_utils.queries import QueryCapture
+from test_utils.schema import schema_hash
+from test_utils.truncation import backend_name
+
+
+# Bump this when the compiled format changes:
+FORMAT_VERSION = 1
+
+# Max number of primary keys to delete with a single query:
+DELETE_BATCH_SIZE = 500
+
+# Compiled-fixture key -> compiled fixture, or None if it can't be compiled:
+_compiled = {}
+
+
+def _cache_dir():
+    cache_home = (os.environ.get('XDG_CACHE_HOME') or
+                  os.path.join(os.path.expanduser('~'), '.cache'))
+    return getattr(settings, 'TEST_UTILS_COMPILED_FIXTURE_DIR',
+                   os.path.join(cache_home, 'test_utils', 'fixtures'))
+
+
+def _trusted(stat_result):
+    """Return whether a file we've stat'ed is ours, and only ours to
+    write."""
+    return (stat_result.st_uid == os.getuid() and
+            not stat_result.st_mode & (stat.S_IWGRP | stat.S_IWOTH))
+
+
+def _key(fixture_labels, files, using):
+    key = hashlib.sha1(repr((FORMAT_VERSION, using, list(fixture_labels),
+                             schema_hash(connections[using]))))
+    for path, format, compression_format in files:
+        key.update(content_hash(path))
+    return key.hexdigest()
+
+
+def compile_fixtures(fixture_labels, using):
+    """Deserialize the fixtures, and return them in compiled form: a dict
+    with a list of (app label, model name, table, columns, rows) under
+    ``'models'`` and of (table, columns, rows) for many-to-many tables under
+    ``'m2m'``.
+
+    Raise whatever deserialization does if it can't be done without loading
+    the fixtures.
+
+    """
+    models = {}
+    m2m = {}
+    order = []
+    for path, format, compression_format in find_fixture_files(
+            fixture_labels, using=using):
+        fixture = open_fixture(path, compression_format)
+        lookups = QueryCapture([using])
+        try:
+            with lookups:
+                objects = list(serializers.deserialize(format, fixture,
+                                                       using=using))
+            if len(lookups):
+                # Deserializing only queries the DB to look up natural keys,
+                # and what they resolve to depends on what's in it now, which
+                # the compiled fixture can't be keyed on.
+                raise ValueError("Can't compile fixtures with natural keys.")
+            for obj in objects:
+                model = obj.object.__class__
+                if not router.allow_syncdb(using, model):
+                    continue
+                opts = model._meta
+                if model not in models:
+                    order.append(model)
+                    models[model] = []
+                models[model].append(tuple(
+                    getattr(obj.object, f.attname) for f in opts.local_fields))
+                if obj.m2m_data and obj.object.pk is None:
+                    # Its related rows would need the pk the DB gives it.
+                    raise ValueError("Can't compile m2m data of an object "
+                                     "without a primary key.")
+                for name, pks in (obj.m2m_data or {}).iteritems():
+                    field = opts.get_field(name)
+                    through = field.rel.through._meta
+                    rows = m2m.setdefault(
+                        (through.db_table, field.m2m_column_name(),
+                         field.m2m_reverse_name()), [])
+                    rows.extend((obj.object.pk, pk) for pk in pks)
+        finally:
+            fixture.close()
+
+    return {
+        'models': [(m._meta.app_label, m._meta.object_name, m._meta.db_table,
+                    [f.column for f in m._meta.local_fields], models[m])
+                   for m in order],
+        'm2m': [(table, [from_column, to_column], rows) for
+                (table, from_column, to_column), rows in m2m.iteritems()],
+    }
+
+
+def compiled_fixtures(fixture_labels, using):
+    """Return the compiled form of the fixtures, compiling them if necessary,
+    or None if they can't be compiled."""
+    files = find_fixture_files(fixture_labels, using=using)
+    if not files:
+        return None
+    key = _key(fixture_labels, files, using)
+    if key in _compiled:
+        return _compiled[key]
+
+    path = os.path.join(_cache_dir(), key + '.fixture')
+    try:
+        with open(path, 'rb') as f:
+            if (_trusted(os.fstat(f.fileno())) and
+                _trusted(os.stat(_cache_dir()))):
+                _compiled[key] = pickle.loads(zlib.decompress(f.read()))
+                return _compiled[key]
+    except Exception:
+        pass
+
+    try:
+        compiled = compile_fixtures(fixture_labels, using)
+    except (SystemExit, KeyboardInterrupt):
+        raise
+    except Exception:
+        # Don't try again this run:
+        _compiled[key] = None
+        return None
+
+    _compiled[key] = compiled
+    try:
+        if not os.path.isdir(_cache_dir()):
+            os.makedirs(_cache_dir(), 0o700)
+        fd, temp_path = tempfile.mkstemp(dir=_cache_dir())
+        with os.fdopen(fd, 'wb') as f:
+            f.write(zlib.compress(
+                pickle.dumps(compiled, pickle.HIGHEST_PROTOCOL)))
+        os.rename(temp_path, path)
+    except (IOError, OSError):
+        pass
+    return compiled
+
+
+def compiled_tables(fixture_labels, using):
+    """Return the set of tables the fixtures load into, or None if they can't
+    be compiled."""
+    compiled = compiled_fixtures(fixture_labels, using)
+    if compiled is None:
+        return None
+    return (set(table for _, _, table, _, _ in compiled['models']) |
+            set(table for table, _, _ in compiled['m2m']))
+
+
+def _insert(cursor, qn, table, columns, rows):
+    cursor.executemany('INSERT INTO %s (%s) VALUES (%s)' % (
+        qn(table), ', '.join(qn(c) for c in columns),
+        ', '.join(['%s'] * len(columns))), rows)
+
+
+def _prepared(fields, rows, connection):
+    return [[f.get_db_prep_save(value, connection=connection)
+             for f, value in zip(fields, row)] for row in rows]
+
+
+def _delete(cursor, qn, table, column, values):
+    for start in xrange(0, len(values), DELETE_BATCH_SIZE):
+        batch = values[start:start + DELETE_BATCH_SIZE]
+        cursor.execute('DELETE FROM %s WHERE %s IN (%s)' % (
+            qn(table), qn(column), ', '.join(['%s'] * len(batch))), batch)
+
+
+def load_compiled_fixtures(fixture_labels, using):
+    """Load the fixtures from their compiled form, and leave the transaction
+    uncommitted.
+
+    Return False, having loaded nothing, if they can't be compiled.
+
+    """
+    compiled = compiled_fixtures(fixture_labels, using)
+    if compiled is None:
+        return False
+
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    mysql = backend_name(connection) == 'mysql'
+    cursor = connection.cursor()
+    if mysql:
+        cursor.execute('SET foreign_key_checks = 0')
+
+    models = []
+    for app_label, object_name, table, columns, rows in compiled['models']:
+        model = get_model(app_label, object_name)
+        models.append(model)
+        fields = model._meta.local_fields
+        pk_index = fields.index(model._meta.pk)
+        # Later fixtures override earlier ones, and fixtures override what's
+        # in the DB already, as in loaddata:
+        keyed = dict((row[pk_index], row) for row in rows
+                     if row[pk_index] is not None).values()
+        if keyed:
+            _delete(cursor, qn, table, model._meta.pk.column,
+                    [row[pk_index] for row in keyed])
+            _insert(cursor, qn, table, columns,
+                    _prepared(fields, keyed, connection))
+        # Objects without a primary key are each new, and the DB picks one:
+        new = [row[:pk_index] + row[pk_index + 1:] for row in rows
+               if row[pk_index] is None]
+        if new:
+            _insert(cursor, qn, table,
+                    columns[:pk_index] + columns[pk_index + 1:],
+                    _prepared(fields[:pk_index] + fields[pk_index + 1:], new,
+                              connection))
+
+    for table, columns, rows in compiled['m2m']:
+        # Loading an object replaces its whole set of related objects:
+        sources = list(set(row[0] for row in rows))
+        _delete(cursor, qn, table, columns[0], sources)
+        _insert(cursor, qn, table, columns, sorted(set(rows)))
+
+    if mysql:
+        cursor.execute('SET foreign_key_checks = 1')
+
+    # As loaddata does, since we inserted explicit primary keys:
+    for statement in connection.ops.sequence_reset_sql(no_style(), models):
+        cursor.execute(statement)
+    return True
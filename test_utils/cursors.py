@@ -0,0 +1,83 @@
+"""Hooks for watching every query that goes through Django's DB cursors.
+
+An observer is a callable taking ``(sql, params, duration, many)``. It's
+called after each ``execute()`` or ``executemany()`` on any connection to the
+DB alias it was registered for, from any thread. When no observers are
+registered, cursors come back unwrapped, so this costs next to nothing.
+
+"""
+import time
+
+from django.db.backends import BaseDatabaseWrapper
+
+
+# DB alias -> list of observers:
+_observers = {}
+
+
+class ObservedCursor(object):
+    """Cursor wrapper which reports each query to the alias's observers."""
+
+    def __init__(self, cursor, alias):
+        self.cursor = cursor
+        self.alias = alias
+
+    def _observe(self, method, sql, params, many):
+        start = time.time()
+        try:
+            # No params means no %-substitution at all, unlike empty ones:
+            if params is None:
+                return method(sql)
+            return method(sql, params)
+        finally:
+            duration = time.time() - start
+            for observer in _observers.get(self.alias, ()):
+                observer(sql, params, duration, many)
+
+    def execute(self, sql, params=None):
+        return self._observe(self.cursor.execute, sql, params, False)
+
+    def executemany(self, sql, param_list):
+        return self._observe(self.cursor.executemany, sql, param_list, True)
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        # Django 1.7+: "with connection.cursor() as cursor:"
+        self.cursor.__enter__()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        return self.cursor.__exit__(type, value, traceback)
+
+
+_old_cursor = BaseDatabaseWrapper.cursor
+def _observed_cursor(self, *args, **kwargs):
+    cursor = _old_cursor(self, *args, **kwargs)
+    if _observers.get(self.alias):
+        return ObservedCursor(cursor, self.alias)
+    return cursor
+
+
+def add_cursor_observer(alias, observer):
+    """Start calling ``observer`` for each query run against ``alias``.
+
+    Cursors obtained while ``alias`` had no observers at all aren't wrapped,
+    so they won't be observed.
+
+    """
+    if BaseDatabaseWrapper.cursor is not _observed_cursor:
+        BaseDatabaseWrapper.cursor = _observed_cursor
+    # Replace rather than mutate, so queries iterating over the old list in
+    # other threads aren't disturbed:
+    _observers[alias] = _observers.get(alias, []) + [observer]
+
+
+def remove_cursor_observer(alias, observer):
+    """Stop calling ``observer`` for queries against ``alias``."""
+    _observers[alias] = [o for o in _observers.get(alias, [])
+                         if o is not observer]
@@ -0,0 +1,109 @@
+"""Keep track of which tables have been written to, so teardown can empty only
+those rather than every table in the DB.
+
+Each DB alias gets one tracker, which watches every query through
+``test_utils.cursors``. Until a full sweep has happened, and whenever a query
+writes in a way we can't classify (DDL, stored procedures, multiple
+statements...), the tracker admits it doesn't know, and callers should fall
+back to emptying everything.
+
+"""
+import re
+from contextlib import contextmanager
+
+from test_utils.cursors import add_cursor_observer, remove_cursor_observer
+
+
+_NAME = r'(?:[`"\[]?\w+[`"\]]?\.)?[`"\[]?(\w+)[`"\]]?'
+_WRITE = re.compile(
+    r'^\s*(?:'
+    r'(?:INSERT|REPLACE)\s+(?:(?:OR\s+\w+|IGNORE|LOW_PRIORITY|DELAYED)\s+)*'
+    r'INTO\s+%(name)s|'
+    r'UPDATE\s+(?:(?:OR\s+\w+|IGNORE|LOW_PRIORITY|ONLY)\s+)*%(name)s|'
+    r'DELETE\s+(?:(?:IGNORE|LOW_PRIORITY|QUICK)\s+)*FROM\s+'
+    r'(?:ONLY\s+)?%(name)s|'
+    r'TRUNCATE\s+(?:TABLE\s+)?%(name)s\s*$)' % {'name': _NAME},
+    re.IGNORECASE)
+
+# Statements which can't change the contents of any table:
+_HARMLESS = re.compile(
+    r'^\s*(?:SELECT|SAVEPOINT|RELEASE|ROLLBACK|COMMIT|BEGIN|START|SET|SHOW|'
+    r'PRAGMA|EXPLAIN|DESCRIBE|DESC)\b',
+    re.IGNORECASE)
+
+
+def written_table(sql):
+    """Return the table ``sql`` writes to, None if it writes nothing, or True
+    if we can't tell."""
+    if ';' in sql.strip().rstrip(';'):
+        # More than one statement. Too clever for us.
+        return True
+    match = _WRITE.match(sql)
+    if match:
+        return next(g for g in match.groups() if g)
+    if _HARMLESS.match(sql) and not re.search(r'\bINTO\b', sql, re.I):
+        return None
+    return True
+
+
+class DirtyTableTracker(object):
+    """Records the tables written to on a DB alias since the last reset."""
+
+    def __init__(self):
+        self.tables = set()
+        # We haven't been watching since the beginning of time:
+        self.everything = True
+        self.skipped = 0
+
+    def __call__(self, sql, params, duration, many):
+        if self.everything:
+            return
+        table = written_table(sql)
+        if table is True:
+            self.everything = True
+        elif table:
+            self.tables.add(table)
+
+    def tables_to_empty(self, tables):
+        """Narrow ``tables`` to the ones which might have been written to,
+        keeping count of how many we got to leave alone."""
+        if self.everything:
+            return set(tables)
+        dirty = set(tables) & self.tables
+        self.skipped += len(tables) - len(dirty)
+        return dirty
+
+    def reset(self):
+        """Note that every table is clean again."""
+        self.tables = set()
+        self.everything = False
+
+
+# DB alias -> tracker:
+_trackers = {}
+
+
+def tracker_for(alias):
+    """Return the tracker for ``alias``, starting one if necessary."""
+    if alias not in _trackers:
+        _trackers[alias] = DirtyTableTracker()
+        add_cursor_observer(alias, _trackers[alias])
+    return _trackers[alias]
+
+
+def skipped_count():
+    """Return how many table truncations tracking has saved so far."""
+    return sum(t.skipped for t in _trackers.values())
+
+
+@contextmanager
+def recording_writes(alias):
+    """Yield a fresh tracker which records the tables written to on
+    ``alias`` within the ``with`` block."""
+    tracker = DirtyTableTracker()
+    tracker.reset()
+    add_cursor_observer(alias, tracker)
+    try:
+        yield tracker
+    finally:
+        remove_cursor_observer(alias, tracker)
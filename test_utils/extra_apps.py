@@ -0,0 +1,186 @@
+"""Install apps just for a test class, creating only their tables.
+
+Running ``syncdb`` for every ``ExtraAppTestCase`` inspected every table in the
+project just to create a few. Instead, we generate the DDL for the extra apps'
+models alone, and remember which tables exist, this process and (through the
+schema fingerprints stored in a reused test DB) in later runs, so repeated
+classes with the same ``extra_apps`` don't touch the DB at all. Tables whose
+models have changed since they were created are dropped and created again.
+
+The app registry entries are remembered too, so reinstalling an app is a few
+dict assignments.
+
+"""
+from django.conf import settings
+from django.core import management
+from django.core.management.color import no_style
+from django.core.management.sql import emit_post_sync_signal
+from django.db import connections, router
+from django.db.models import get_models, loading
+
+from test_utils.schema import (EXTRA_PREFIX, model_fingerprint,
+                               store_extra_fingerprints, stored_fingerprint)
+from test_utils.truncation import backend_name
+
+
+# App label -> (models module, its app_models dict), for apps we've
+# uninstalled and may install again:
+_registry = {}
+
+# DB alias -> {table: fingerprint} of the tables known to be up to date:
+_tables = {}
+
+
+def _clear_model_caches():
+    # Otherwise get_models() keeps returning what it did before:
+    getattr(loading.cache, '_get_models_cache', {}).clear()
+
+
+def install_app(app):
+    """Add the app with the dotted name ``app`` to the app registry and
+    ``INSTALLED_APPS``."""
+    settings.INSTALLED_APPS += (app,)
+    app_name = app.split('.')[-1]
+    if app_name in _registry and hasattr(loading.cache, 'app_store'):
+        # Django <= 1.6.
+        module, models = _registry[app_name]
+        loading.cache.app_models[app_name] = models
+        loading.cache.app_store[module] = len(loading.cache.app_store)
+        _clear_model_caches()
+    else:
+        loading.load_app(app)
+
+
+def uninstall_app(app):
+    """Undo ``install_app``."""
+    app_name = app.split('.')[-1]
+    module = loading.cache.get_app(app_name)
+    try:
+        # Django <= 1.6.
+        models = loading.cache.app_models.pop(app_name)
+    except AttributeError:
+        # Django 1.7+.
+        del loading.cache.all_models[app_name]
+    else:
+        _registry[app_name] = module, models
+    try:
+        # Django <= 1.6.
+        del loading.cache.app_store[module]
+    except AttributeError:
+        pass
+    _clear_model_caches()
+    settings.INSTALLED_APPS = tuple(a for a in settings.INSTALLED_APPS
+                                    if a != app)
+
+
+def _known_tables(connection):
+    """Return {table: fingerprint} for the tables already in the DB, with
+    None for those we don't know the fingerprint of."""
+    if connection.alias not in _tables:
+        stored = stored_fingerprint(connection) or {}
+        _tables[connection.alias] = dict(
+            (table, stored.get(EXTRA_PREFIX + table))
+            for table in connection.introspection.table_names())
+    return _tables[connection.alias]
+
+
+def _references(model):
+    """Return the tables ``model``'s foreign keys point at, other than its
+    own."""
+    return set(f.rel.to._meta.db_table for f in model._meta.local_fields
+               if getattr(f, 'rel', None) and
+               hasattr(f.rel.to, '_meta') and f.rel.to is not model)
+
+
+def _drop_order(models):
+    """Order ``models`` so each comes before the models it refers to."""
+    ordered = []
+    remaining = list(models)
+    while remaining:
+        referenced = set()
+        for model in remaining:
+            referenced |= _references(model)
+        free = [m for m in remaining if m._meta.db_table not in referenced]
+        if not free:
+            # A cycle. Leave it to the DB (and CASCADE) to sort out.
+            free = remaining
+        ordered.extend(free)
+        remaining = [m for m in remaining if m not in free]
+    return ordered
+
+
+def create_app_tables(apps, using):
+    """Create the tables of the installed apps with the given dotted names on
+    DB ``using``, unless they're there and up to date already."""
+    connection = connections[using]
+    if not hasattr(connection.creation, 'sql_create_model'):
+        # Django 1.7+ has no model-level DDL to borrow.
+        management.call_command('syncdb', verbosity=0, interactive=False,
+                                database=using)
+        return
+
+    known = _known_tables(connection)
+    models = []
+    for app in apps:
+        app_module = loading.cache.get_app(app.split('.')[-1])
+        models.extend(m for m in get_models(app_module,
+                                            include_auto_created=True)
+                      if router.allow_syncdb(using, m))
+    fingerprints = dict((m._meta.db_table, model_fingerprint(m, connection))
+                        for m in models)
+    stale = [m for m in models if m._meta.db_table in known and
+             known[m._meta.db_table] not in
+             (None, fingerprints[m._meta.db_table])]
+    # A table pointing at a dropped one would lose its foreign keys, so
+    # those are dropped and created again as well:
+    stale_tables = set(m._meta.db_table for m in stale)
+    while True:
+        more = [m for m in models if m._meta.db_table in known and
+                m._meta.db_table not in stale_tables and
+                _references(m) & stale_tables]
+        if not more:
+            break
+        stale.extend(more)
+        stale_tables.update(m._meta.db_table for m in more)
+    missing = [m for m in models if m._meta.db_table not in known] + stale
+    if not missing:
+        return
+
+    # Much like syncdb does, but only for these models:
+    style = no_style()
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    # Tables outside these apps may point at them, too:
+    cascade = ' CASCADE' if backend_name(connection) == 'postgresql' else ''
+    for model in _drop_order(stale):
+        cursor.execute('DROP TABLE %s%s' % (qn(model._meta.db_table),
+                                            cascade))
+    seen_models = connection.introspection.installed_models(
+        [t for t in known if t not in stale_tables])
+    pending_references = {}
+    for model in missing:
+        sql, references = connection.creation.sql_create_model(
+            model, style, seen_models)
+        seen_models.add(model)
+        for refto, refs in references.items():
+            pending_references.setdefault(refto, []).extend(refs)
+            if refto in seen_models:
+                sql.extend(connection.creation.sql_for_pending_references(
+                    refto, style, pending_references))
+        sql.extend(connection.creation.sql_for_pending_references(
+            model, style, pending_references))
+        for statement in sql:
+            cursor.execute(statement)
+    for model in missing:
+        for statement in connection.creation.sql_indexes_for_model(model,
+                                                                   style):
+            cursor.execute(statement)
+    # For content types, permissions and the like:
+    emit_post_sync_signal(set(missing), 0, False, using)
+    connection.commit_unless_managed()
+
+    created = dict((m._meta.db_table, fingerprints[m._meta.db_table])
+                   for m in missing)
+    known.update(created)
+    if stored_fingerprint(connection) is not None:
+        store_extra_fingerprints(connection, created)
@@ -1,14 +1,32 @@
 """A copy of Django 1.3.0's stock loaddata.py, adapted so that, instead of
 loading any data, it returns the tables referenced by a set of fixtures so we
-can truncate them (and no others) quickly after we're finished with them."""
+can truncate them (and no others) quickly after we're finished with them.
+
+JSON and XML fixtures, compressed or not, are streamed through a chunk at a
+time, picking out just the model of each record, so even huge fixtures take
+little memory to scan. Other formats are deserialized.
+
+Since scanning a big fixture is slow and we need the answer once per class
+per database, results are memoized on the fixtures' path, mtime, and size,
+and the schema, since that says which table each model has. Set
+``TEST_UTILS_FIXTURE_CACHE`` to a file path to keep the memo, as JSON, between
+test runs as well, so a fresh run re-parses only fixtures that have changed.
+
+"""
 
 import gzip
+import hashlib
+import json
 import os
+import tempfile
 import zipfile
+from xml.etree import cElementTree
 from django.conf import settings
 from django.core import serializers
-from django.db import DEFAULT_DB_ALIAS, router
-from django.db.models import get_apps
+from django.db import connections, DEFAULT_DB_ALIAS, router
+from django.db.models import get_apps, get_model
+
+from test_utils.schema import schema_hash
 
 # Remove this try/except block if the minimum Python version suported is 2.6
 # as `product` was added in Python 2.6.
@@ -25,24 +43,37 @@ except ImportError:
     has_bz2 = False
 
 
-def tables_used_by_fixtures(fixture_labels, using=DEFAULT_DB_ALIAS):
-    """Act like Django's stock loaddata command, but, instead of loading data,
-    return an iterable of the names of the tables into which data would be
-    loaded."""
-    # Keep a count of the installed objects and fixtures
-    fixture_count = 0
-    loaded_object_count = 0
-    fixture_object_count = 0
-    tables = set()
+# (tuple of fixture labels, db alias) -> (file signatures, tables):
+_label_cache = {}
+
+# {db alias: {path: [mtime, size, schema hash, sorted tables]}}. Loaded
+# lazily from TEST_UTILS_FIXTURE_CACHE, if set:
+_file_cache = None
 
-    class SingleZipReader(zipfile.ZipFile):
-        def __init__(self, *args, **kwargs):
-            zipfile.ZipFile.__init__(self, *args, **kwargs)
-            if settings.DEBUG:
-                assert len(self.namelist()) == 1, "Zip-compressed fixtures must contain only one file."
-        def read(self):
-            return zipfile.ZipFile.read(self, self.namelist()[0])
+# (path, mtime, size) -> hash of the file's contents:
+_content_hashes = {}
 
+# directory -> (mtime, frozenset of the names in it):
+_listings = {}
+
+# (tuple of fixture labels, db alias, tuple of fixture dirs) ->
+#     ([(directory, mtime)...], result of find_fixture_files):
+_resolved = {}
+
+
+class SingleZipReader(zipfile.ZipFile):
+    def __init__(self, *args, **kwargs):
+        zipfile.ZipFile.__init__(self, *args, **kwargs)
+        if settings.DEBUG:
+            assert len(self.namelist()) == 1, "Zip-compressed fixtures must contain only one file."
+    def read(self):
+        return zipfile.ZipFile.read(self, self.namelist()[0])
+    def stream(self):
+        """Return a file-like object for reading the member bit by bit."""
+        return self.open(self.namelist()[0])
+
+
+def _compression_types():
     compression_types = {
         None: file,
         'gz': gzip.GzipFile,
@@ -50,7 +81,79 @@ def tables_used_by_fixtures(fixture_labels, using=DEFAULT_DB_ALIAS):
     }
     if has_bz2:
         compression_types['bz2'] = bz2.BZ2File
+    return compression_types
+
+
+def file_signature(path):
+    """Return a (path, mtime, size) tuple which changes when the file does."""
+    stat = os.stat(path)
+    return path, stat.st_mtime, stat.st_size
+
+
+def open_fixture(full_path, compression_format):
+    """Open a fixture file for reading, decompressing as necessary."""
+    return _compression_types()[compression_format](full_path, 'r')
+
 
+def content_hash(path):
+    """Return a hash of the contents of the file at ``path``, only rereading
+    it if it's changed."""
+    signature = file_signature(path)
+    if signature not in _content_hashes:
+        with open(path, 'rb') as f:
+            _content_hashes[signature] = hashlib.sha1(f.read()).hexdigest()
+    return _content_hashes[signature]
+
+
+def _cache_path():
+    return getattr(settings, 'TEST_UTILS_FIXTURE_CACHE', None)
+
+
+def _load_file_cache():
+    global _file_cache
+    if _file_cache is None:
+        _file_cache = {}
+        path = _cache_path()
+        if path:
+            try:
+                with open(path) as f:
+                    cache = json.load(f)
+                if isinstance(cache, dict):
+                    _file_cache = cache
+            except Exception:
+                # Missing, truncated, or from an incompatible version. We'll
+                # just rebuild it.
+                pass
+    return _file_cache
+
+
+def _save_file_cache():
+    path = _cache_path()
+    if not path:
+        return
+    # Write to a temp file and rename so a concurrent or interrupted run never
+    # sees half a file.
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        fd, temp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(_file_cache, f)
+        os.rename(temp_path, path)
+    except (IOError, OSError):
+        pass
+
+
+def clear_fixture_cache():
+    """Forget everything we know about fixtures, in memory and on disk."""
+    global _file_cache
+    _label_cache.clear()
+    _file_cache = {}
+    path = _cache_path()
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+def _app_fixture_dirs():
     app_module_paths = []
     for app in get_apps():
         if hasattr(app, '__path__'):
@@ -61,7 +164,82 @@ def tables_used_by_fixtures(fixture_labels, using=DEFAULT_DB_ALIAS):
             # It's a models.py module
             app_module_paths.append(app.__file__)
 
-    app_fixtures = [os.path.join(os.path.dirname(path), 'fixtures') for path in app_module_paths]
+    return [os.path.join(os.path.dirname(path), 'fixtures') for path in app_module_paths]
+
+
+def _listing(directory):
+    """Return the names in ``directory``, listing it again only if its mtime
+    has changed."""
+    directory = directory or os.curdir
+    try:
+        mtime = os.stat(directory).st_mtime
+    except OSError:
+        mtime = None
+    cached = _listings.get(directory)
+    if cached is None or cached[0] != mtime:
+        try:
+            names = frozenset(os.listdir(directory))
+        except OSError:
+            names = frozenset()
+        cached = _listings[directory] = mtime, names
+    return cached[1]
+
+
+def _exists(full_path):
+    directory, name = os.path.split(full_path)
+    return name in _listing(directory)
+
+
+def _listings_unchanged(mtimes):
+    for directory, mtime in mtimes:
+        try:
+            if os.stat(directory).st_mtime != mtime:
+                return False
+        except OSError:
+            if mtime is not None:
+                return False
+    return True
+
+
+def find_fixture_files(fixture_labels, using=DEFAULT_DB_ALIAS):
+    """Return a list of (path, format, compression format) tuples for the
+    files loaddata would load for the given labels.
+
+    Return None if loaddata would bail out on them.
+
+    Rather than trying to open every possible file name in every fixture
+    directory, we look names up in an index of the directories' contents,
+    which is refreshed whenever a directory's mtime changes, and remember the
+    answer for each set of labels.
+
+    """
+    fixture_dirs = _app_fixture_dirs() + list(settings.FIXTURE_DIRS) + ['']
+    key = tuple(fixture_labels), using, tuple(fixture_dirs)
+    cached = _resolved.get(key)
+    if cached and _listings_unchanged(cached[0]):
+        return cached[1]
+
+    found = _find_fixture_files(fixture_labels, using, fixture_dirs)
+    consulted = set(os.path.dirname(path) or os.curdir
+                    for path in _consulted(fixture_labels, fixture_dirs))
+    _resolved[key] = ([(d, _listings.get(d, (None,))[0]) for d in consulted],
+                      found)
+    return found
+
+
+def _consulted(fixture_labels, fixture_dirs):
+    """Yield a path in each directory a lookup of these labels looks in."""
+    for fixture_label in fixture_labels:
+        if os.path.isabs(fixture_label):
+            yield fixture_label
+        else:
+            for fixture_dir in fixture_dirs:
+                yield os.path.join(fixture_dir, fixture_label)
+
+
+def _find_fixture_files(fixture_labels, using, app_and_other_dirs):
+    compression_types = _compression_types()
+    found = []
     for fixture_label in fixture_labels:
         parts = fixture_label.split('.')
 
@@ -84,12 +262,12 @@ def tables_used_by_fixtures(fixture_labels, using=DEFAULT_DB_ALIAS):
         if not formats:
             # stderr.write(style.ERROR("Problem installing fixture '%s': %s is
             # not a known serialization format.\n" % (fixture_name, format)))
-            return set()
+            return None
 
         if os.path.isabs(fixture_name):
             fixture_dirs = [fixture_name]
         else:
-            fixture_dirs = app_fixtures + list(settings.FIXTURE_DIRS) + ['']
+            fixture_dirs = app_and_other_dirs
 
         for fixture_dir in fixture_dirs:
             # stdout.write("Checking %s for fixtures...\n" %
@@ -108,54 +286,182 @@ def tables_used_by_fixtures(fixture_labels, using=DEFAULT_DB_ALIAS):
                 # stdout.write("Trying %s for %s fixture '%s'...\n" % \
                 # (humanize(fixture_dir), file_name, fixture_name))
                 full_path = os.path.join(fixture_dir, file_name)
-                open_method = compression_types[compression_format]
-                try:
-                    fixture = open_method(full_path, 'r')
-                    if label_found:
-                        fixture.close()
-                        # stderr.write(style.ERROR("Multiple fixtures named
-                        # '%s' in %s. Aborting.\n" % (fixture_name,
-                        # humanize(fixture_dir))))
-                        return set()
-                    else:
-                        fixture_count += 1
-                        objects_in_fixture = 0
-                        loaded_objects_in_fixture = 0
-                        # stdout.write("Installing %s fixture '%s' from %s.\n"
-                        # % (format, fixture_name, humanize(fixture_dir)))
-                        try:
-                            objects = serializers.deserialize(format, fixture, using=using)
-                            for obj in objects:
-                                objects_in_fixture += 1
-                                if router.allow_syncdb(using, obj.object.__class__):
-                                    loaded_objects_in_fixture += 1
-                                    tables.add(
-                                        obj.object.__class__._meta.db_table)
-                            loaded_object_count += loaded_objects_in_fixture
-                            fixture_object_count += objects_in_fixture
-                            label_found = True
-                        except (SystemExit, KeyboardInterrupt):
-                            raise
-                        except Exception:
-                            fixture.close()
-                            # stderr.write( style.ERROR("Problem installing
-                            # fixture '%s': %s\n" % (full_path, ''.join(tra
-                            # ceback.format_exception(sys.exc_type,
-                            # sys.exc_value, sys.exc_traceback)))))
-                            return set()
-                        fixture.close()
-
-                        # If the fixture we loaded contains 0 objects, assume that an
-                        # error was encountered during fixture loading.
-                        if objects_in_fixture == 0:
-                            # stderr.write( style.ERROR("No fixture data found
-                            # for '%s'. (File format may be invalid.)\n" %
-                            # (fixture_name)))
-                            return set()
-
-                except Exception:
+                if not _exists(full_path):
                     # stdout.write("No %s fixture '%s' in %s.\n" % \ (format,
                     # fixture_name, humanize(fixture_dir)))
-                    pass
+                    continue
+                if label_found:
+                    # stderr.write(style.ERROR("Multiple fixtures named
+                    # '%s' in %s. Aborting.\n" % (fixture_name,
+                    # humanize(fixture_dir))))
+                    return None
+                label_found = True
+                found.append((full_path, format, compression_format))
+    return found
+
+
+# How much of a fixture to read at a time when streaming through it:
+CHUNK_SIZE = 64 * 1024
+
+
+def _json_models(stream):
+    """Yield the ``model`` of each record of a JSON fixture, holding no more
+    than one record in memory at a time."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    while True:
+        buffer = buffer.lstrip()
+        if not started and buffer:
+            if buffer[0] != '[':
+                raise ValueError('Fixture is not a JSON list.')
+            buffer, started = buffer[1:], True
+            continue
+        if started and buffer.startswith(','):
+            buffer = buffer[1:]
+            continue
+        if started and buffer.startswith(']'):
+            return
+        try:
+            record, end = decoder.raw_decode(buffer)
+        except ValueError:
+            # Probably just a partial record. Read some more:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                raise
+            buffer += chunk
+            continue
+        buffer = buffer[end:]
+        yield record['model']
+
+
+def _xml_models(stream):
+    """Yield the ``model`` of each ``<object>`` in an XML fixture, throwing
+    each away as soon as it's seen."""
+    root = None
+    # Only <object>s right under <django-objects> are records; those inside
+    # a many-to-many <field> just point at other records.
+    depth = 0
+    for event, element in cElementTree.iterparse(stream, ('start', 'end')):
+        if event == 'start':
+            depth += 1
+            if root is None:
+                root = element
+            continue
+        depth -= 1
+        if depth == 1 and element.tag == 'object':
+            yield element.get('model')
+            root.clear()
+
+
+# Formats we can pick model names out of without deserializing anything:
+_model_scanners = {
+    'json': _json_models,
+    'xml': _xml_models,
+}
+
+
+def _scanned_models(fixture, format, using):
+    """Yield the model class of each record in the fixture.
+
+    Formats we can stream through are read a chunk at a time, without
+    building model instances, so memory use stays flat however big the
+    fixture is. Others are deserialized.
+
+    """
+    if format in _model_scanners:
+        stream = fixture.stream() if hasattr(fixture, 'stream') else fixture
+        models = {}
+        for label in _model_scanners[format](stream):
+            if label not in models:
+                app_label, model_name = label.split('.')
+                models[label] = get_model(app_label, model_name)
+                if models[label] is None:
+                    raise ValueError('Unknown model in fixture: %s' % label)
+            yield models[label]
+    else:
+        for obj in serializers.deserialize(format, fixture, using=using):
+            yield obj.object.__class__
+
+
+def _tables_in_fixture(full_path, format, compression_format, using):
+    """Scan one fixture file, and return the set of tables it loads into, or
+    None if loaddata would choke on it."""
+    tables = set()
+    objects_in_fixture = 0
+    fixture = open_fixture(full_path, compression_format)
+    # stdout.write("Installing %s fixture '%s' from %s.\n"
+    # % (format, fixture_name, humanize(fixture_dir)))
+    try:
+        for model in _scanned_models(fixture, format, using):
+            objects_in_fixture += 1
+            if router.allow_syncdb(using, model):
+                tables.add(model._meta.db_table)
+    except (SystemExit, KeyboardInterrupt):
+        raise
+    except Exception:
+        # stderr.write( style.ERROR("Problem installing
+        # fixture '%s': %s\n" % (full_path, ''.join(tra
+        # ceback.format_exception(sys.exc_type,
+        # sys.exc_value, sys.exc_traceback)))))
+        return None
+    finally:
+        fixture.close()
+
+    # If the fixture we loaded contains 0 objects, assume that an
+    # error was encountered during fixture loading.
+    if objects_in_fixture == 0:
+        # stderr.write( style.ERROR("No fixture data found
+        # for '%s'. (File format may be invalid.)\n" %
+        # (fixture_name)))
+        return None
+    return tables
+
+
+def _signatures_unchanged(signatures):
+    try:
+        return all(file_signature(s[0]) == s for s in signatures)
+    except OSError:
+        return False
+
+
+def tables_used_by_fixtures(fixture_labels, using=DEFAULT_DB_ALIAS):
+    """Act like Django's stock loaddata command, but, instead of loading data,
+    return an iterable of the names of the tables into which data would be
+    loaded."""
+    key = tuple(fixture_labels), using
+    cached = _label_cache.get(key)
+    if cached and _signatures_unchanged(cached[0]):
+        return set(cached[1])
+
+    fixtures = find_fixture_files(fixture_labels, using=using)
+    if fixtures is None:
+        return set()
+
+    file_cache = _load_file_cache().setdefault(using, {})
+    schema = schema_hash(connections[using])
+    dirty = False
+    signatures = []
+    tables = set()
+    for full_path, format, compression_format in fixtures:
+        signature = file_signature(full_path)
+        signatures.append(signature)
+        # Only one version of each file is kept, so the cache can't grow
+        # without bound:
+        version = [signature[1], signature[2], schema]
+        entry = file_cache.get(full_path)
+        if entry and entry[:3] == version:
+            file_tables = entry[3]
+        else:
+            file_tables = _tables_in_fixture(full_path, format,
+                                             compression_format, using)
+            if file_tables is None:
+                return set()
+            file_cache[full_path] = version + [sorted(file_tables)]
+            dirty = True
+        tables.update(file_tables)
 
+    if dirty:
+        _save_file_cache()
+    _label_cache[key] = signatures, frozenset(tables)
     return tables
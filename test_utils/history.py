@@ -0,0 +1,195 @@
+"""A nose plugin which remembers how long each test class took and whether it
+failed, and uses that to split the suite across machines and to run recent
+failures first.
+
+The history is kept in ``--history-file`` (``.test_history.json`` by
+default) when running with ``--with-history``, which ``--shard`` and
+``--failed-first`` imply.
+
+``--shard i/M`` runs only the i-th of M shards (counting from 1). Groups of
+classes are dealt out longest first, each to the shard with the least work
+so far, so the shards take about as long as each other. ``FastFixtureTestCase``
+classes with the same fixtures are kept in one group, and so in one shard,
+so those fixtures are still loaded once. Classes with no history are
+assumed to take the average time. The split depends only on the tests and
+the history file, so every machine must see the same history to agree on
+it.
+
+``--failed-first`` runs the classes which failed last time first. Fixture
+bundling keeps that order as far as it can.
+
+"""
+import json
+import os
+from time import time
+
+from nose.plugins import Plugin
+
+import test_utils
+from test_utils.bundling import _flatten, _is_subclass_at_all
+
+
+def _context_name(context):
+    if isinstance(context, type):
+        return '%s.%s' % (context.__module__, context.__name__)
+    return getattr(context, '__name__', repr(context))
+
+
+def _group_key(suite):
+    """Return the key of the group ``suite`` must stay with."""
+    context = getattr(suite, 'context', None)
+    fixtures = getattr(context, 'fixtures', None)
+    if (_is_subclass_at_all(context, test_utils.FastFixtureTestCase) and
+        fixtures):
+        return (frozenset(fixtures), getattr(context, 'multi_db', False))
+    return _context_name(context)
+
+
+def parse_shard(value):
+    """Turn "i/M" into (i, M), complaining if it makes no sense."""
+    try:
+        index, count = [int(n) for n in value.split('/')]
+    except ValueError:
+        raise ValueError('--shard wants i/M, like 2/4, not %r.' % value)
+    if not 1 <= index <= count:
+        raise ValueError('--shard %s: i must be between 1 and M.' % value)
+    return index, count
+
+
+def partition(groups, durations, count):
+    """Deal the groups out into ``count`` shards, longest first, each to the
+    least loaded shard. Return a list of the groups in each shard.
+
+    ``groups`` maps each group's key to a sortable name, used to break ties
+    so that every machine comes up with the same answer.
+
+    """
+    shards = [[] for i in range(count)]
+    loads = [0.0] * count
+    for key in sorted(groups, key=lambda k: (-durations[k], groups[k])):
+        lightest = min(range(count), key=lambda i: (loads[i], i))
+        shards[lightest].append(key)
+        loads[lightest] += durations[key]
+    return shards
+
+
+class HistoryPlugin(Plugin):
+    """Keep per-class durations and outcomes, and shard and order by them."""
+    name = 'history'
+    # Pick the tests before the fixture bundling plugin orders them:
+    score = 200
+
+    def options(self, parser, env):
+        super(HistoryPlugin, self).options(parser, env)
+        parser.add_option('--history-file', dest='history_file',
+                          default=env.get('NOSE_HISTORY_FILE',
+                                          '.test_history.json'),
+                          help='Where to keep the durations and outcomes of '
+                               'test classes [NOSE_HISTORY_FILE]')
+        parser.add_option('--shard', dest='shard', metavar='i/M',
+                          default=env.get('NOSE_SHARD'),
+                          help='Run only the i-th of M equally long shards '
+                               'of the suite. Implies --with-history. '
+                               '[NOSE_SHARD]')
+        parser.add_option('--failed-first', dest='failed_first',
+                          action='store_true', default=False,
+                          help='Run the classes which failed last time '
+                               'first. Implies --with-history.')
+
+    def configure(self, options, conf):
+        super(HistoryPlugin, self).configure(options, conf)
+        shard = getattr(options, 'shard', None)
+        self.shard = parse_shard(shard) if shard else None
+        self.failed_first = getattr(options, 'failed_first', False)
+        if self.shard or self.failed_first:
+            self.enabled = True
+        if not self.enabled:
+            return
+        self.history_file = options.history_file
+        self.history = {}
+        if os.path.exists(self.history_file):
+            with open(self.history_file) as f:
+                self.history = json.load(f)
+        self._started = {}
+        self._failed = set()
+
+    def _duration(self, name):
+        entry = self.history.get(name)
+        if entry:
+            return entry['duration']
+        known = [e['duration'] for e in self.history.values()]
+        return sum(known) / len(known) if known else 1.0
+
+    def _failed_last_time(self, suite):
+        entry = self.history.get(_context_name(getattr(suite, 'context',
+                                                       None)))
+        return bool(entry and entry.get('failed'))
+
+    def prepareTest(self, test):
+        if not (self.shard or self.failed_first):
+            return
+        # {group key: [suite, ...]}, and the keys in the order they came:
+        groups = {}
+        order = []
+
+        def group(suite):
+            key = _group_key(suite)
+            if key not in groups:
+                groups[key] = []
+                order.append(key)
+            groups[key].append(suite)
+        _flatten(test, group)
+
+        if self.shard:
+            index, count = self.shard
+            durations = dict(
+                (key, sum(self._duration(_context_name(
+                     getattr(suite, 'context', None))) for suite in suites))
+                for key, suites in groups.items())
+            names = dict((key, min(_context_name(getattr(s, 'context', None))
+                                   for s in suites))
+                         for key, suites in groups.items())
+            mine = set(partition(names, durations, count)[index - 1])
+            order = [key for key in order if key in mine]
+
+        if self.failed_first:
+            for key in order:
+                groups[key].sort(key=lambda s: not self._failed_last_time(s))
+                for suite in groups[key]:
+                    if (isinstance(getattr(suite, 'context', None), type) and
+                        self._failed_last_time(suite)):
+                        # For the fixture bundling plugin:
+                        suite.context._failed_last_time = True
+            order.sort(key=lambda k: not self._failed_last_time(groups[k][0]))
+
+        # Let the fixture bundling plugin have its turn, too:
+        test._tests = [suite for key in order for suite in groups[key]]
+
+    def startContext(self, context):
+        if isinstance(context, type):
+            self._started[_context_name(context)] = time()
+
+    def stopContext(self, context):
+        name = _context_name(context)
+        if name in self._started:
+            self.history[name] = {
+                'duration': time() - self._started.pop(name),
+                'failed': name in self._failed}
+
+    def _fail(self, test):
+        case = getattr(test, 'test', test)
+        self._failed.add(_context_name(case.__class__))
+
+    def addError(self, test, err):
+        self._fail(test)
+
+    def addFailure(self, test, err):
+        self._fail(test)
+
+    def finalize(self, result):
+        with open(self.history_file, 'w') as f:
+            json.dump(self.history, f, indent=2, sort_keys=True)
+
+    def report(self, stream):
+        if self.shard:
+            stream.writeln('Ran shard %s of %s.' % self.shard)
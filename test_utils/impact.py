@@ -0,0 +1,238 @@
+"""Remember what each test depends on, and run only the tests a change affects.
+
+With ``--with-impact``, every test's dependencies are recorded in an index
+file (``--impact-file``, ``.test_impact.json`` by default):
+
+* the project's Python files whose code ran during the test,
+* the tables it queried, through ``test_utils.cursors``,
+* the fixture files of its class's ``fixtures``,
+* the Jinja2 templates it rendered, through ``template_rendered``.
+
+``--changed-since REV`` (which implies ``--with-impact``) then asks git which
+files have changed since REV and runs only the tests which depend on one of
+them, plus tests the index doesn't know yet. A changed Python file counts
+against the tables of the models it defines, too. If a changed file is one
+no test has been seen to depend on, such as a settings module or a data file
+read outside the code we trace, every test is run, since we can't tell who
+relies on it.
+
+Tracing which code runs slows tests down, so runs with ``--changed-since``
+only select from the index, without recording anything. Keep the index
+fresh with a periodic full run with ``--with-impact``.
+
+"""
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+
+from nose.plugins import Plugin
+
+from test_utils.dirty import _NAME
+
+
+_TABLES = re.compile(r'\b(?:FROM|JOIN|INTO|UPDATE)\s+%s' % _NAME,
+                     re.IGNORECASE)
+
+
+def _git(*args):
+    return subprocess.Popen(('git',) + args,
+                            stdout=subprocess.PIPE).communicate()[0]
+
+
+def repo_root():
+    """Return the root of the git checkout we're in, or the current
+    directory."""
+    root = _git('rev-parse', '--show-toplevel').strip()
+    return root.decode('utf-8') if root else os.getcwd()
+
+
+def changed_files(rev, root):
+    """Return the paths, relative to ``root``, of the files which differ from
+    ``rev`` or are new and untracked."""
+    output = (_git('diff', '--name-only', rev, '--', root) +
+              _git('ls-files', '--others', '--exclude-standard',
+                   '--full-name', root))
+    return set(output.decode('utf-8').split())
+
+
+def load_index(path):
+    """Return {test id: set of dependencies} from the index at ``path``."""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        index = json.load(f)
+    deps = index['deps']
+    return dict((test, set(deps[i] for i in ids))
+                for test, ids in index['tests'].items())
+
+
+def save_index(path, tests):
+    """Write ``tests``, {test id: dependencies}, to ``path``, storing each
+    dependency once."""
+    deps = sorted(set().union(*tests.values())) if tests else []
+    numbers = dict((dep, i) for i, dep in enumerate(deps))
+    with open(path, 'w') as f:
+        json.dump({'deps': deps,
+                   'tests': dict((test, sorted(numbers[d] for d in ds))
+                                 for test, ds in tests.items())},
+                  f, separators=(',', ':'), sort_keys=True)
+
+
+def _model_tables(paths, root):
+    """Return table dependencies for the models defined in ``paths``."""
+    from django.db.models import get_models
+
+    tables = set()
+    for model in get_models(include_auto_created=True):
+        module = sys.modules.get(model.__module__)
+        filename = getattr(module, '__file__', None)
+        if filename:
+            filename = os.path.relpath(filename, root)
+            if re.sub(r'\.py[co]$', '.py', filename) in paths:
+                tables.add('table:' + model._meta.db_table)
+    return tables
+
+
+def _test_id(cls, method):
+    return '%s.%s.%s' % (cls.__module__, cls.__name__, method.__name__)
+
+
+class ImpactPlugin(Plugin):
+    """Record what each test touches, and select tests by what changed."""
+    name = 'impact'
+
+    def options(self, parser, env):
+        super(ImpactPlugin, self).options(parser, env)
+        parser.add_option('--impact-file', dest='impact_file',
+                          default=env.get('NOSE_IMPACT_FILE',
+                                          '.test_impact.json'),
+                          help='Where to keep the index of what each test '
+                               'depends on [NOSE_IMPACT_FILE]')
+        parser.add_option('--changed-since', dest='changed_since',
+                          metavar='REV',
+                          help='Run only the tests affected by changes since '
+                               'the git revision REV. Implies --with-impact.')
+
+    def configure(self, options, conf):
+        super(ImpactPlugin, self).configure(options, conf)
+        self.changed_since = getattr(options, 'changed_since', None)
+        if self.changed_since:
+            self.enabled = True
+        if not self.enabled:
+            return
+        self.index_file = options.impact_file
+        self.root = repo_root()
+        self.index = load_index(self.index_file)
+        self.affected = None
+        self.skipped = 0
+        self._files = {}
+        self._current = set()
+
+    def begin(self):
+        if self.changed_since:
+            self._select()
+            return
+        from django.db import connections
+        from django.test import signals
+        from test_utils.cursors import add_cursor_observer
+        for alias in connections:
+            add_cursor_observer(alias, self._query)
+        signals.template_rendered.connect(self._rendered)
+        sys.settrace(self._trace)
+        threading.settrace(self._trace)
+
+    def _select(self):
+        """Work out which tests are affected by the changes."""
+        changed = changed_files(self.changed_since, self.root)
+        known = set().union(*self.index.values()) if self.index else set()
+        python = set(p for p in changed if p.endswith('.py'))
+        unknown = sorted(p for p in changed
+                         if not p.endswith('.py') and
+                         'fixture:' + p not in known and
+                         'template:' + p not in known)
+        unknown += sorted(p for p in python if 'py:' + p not in known)
+        if unknown:
+            sys.stderr.write('Running every test, since nothing tells us '
+                             'which depend on %s.\n' % ', '.join(unknown[:3]))
+            return
+        deps = set('py:' + p for p in python)
+        deps.update('fixture:' + p for p in changed)
+        deps.update('template:' + p for p in changed)
+        deps.update(_model_tables(python, self.root))
+        self.affected = set(test for test, ds in self.index.items()
+                            if ds & deps)
+
+    def _wants(self, test_id):
+        if self.affected is None or test_id not in self.index:
+            return None
+        if test_id in self.affected:
+            return None
+        self.skipped += 1
+        return False
+
+    def wantMethod(self, method):
+        cls = getattr(method, 'im_class', None)
+        if cls is None:
+            return None
+        return self._wants(_test_id(cls, method))
+
+    def wantFunction(self, function):
+        return self._wants('%s.%s' % (function.__module__,
+                                      function.__name__))
+
+    def _trace(self, frame, event, arg):
+        filename = frame.f_code.co_filename
+        if filename not in self._files:
+            path = os.path.relpath(os.path.abspath(filename), self.root)
+            self._files[filename] = (
+                None if path.startswith('..') or 'site-packages' in path
+                else 'py:' + re.sub(r'\.py[co]$', '.py', path))
+        dep = self._files[filename]
+        if dep:
+            self._current.add(dep)
+        # We only care about which functions are called, not every line:
+        return None
+
+    def _query(self, sql, params, duration, many):
+        self._current.update('table:' + t for t in _TABLES.findall(sql))
+
+    def _rendered(self, sender, template=None, **kwargs):
+        filename = getattr(template, 'filename', None)
+        if filename:
+            self._current.add('template:' +
+                              os.path.relpath(filename, self.root))
+
+    # Whatever happens between tests (like class setup) isn't recorded.
+
+    def startTest(self, test):
+        if self.changed_since:
+            return
+        from test_utils.fixture_tables import find_fixture_files
+        self._current = set()
+        case = getattr(test, 'test', test)
+        fixtures = getattr(case, 'fixtures', None) or []
+        for path, _, _ in find_fixture_files(fixtures, 'default') or []:
+            self._current.add('fixture:' +
+                              os.path.relpath(os.path.abspath(path),
+                                              self.root))
+
+    def stopTest(self, test):
+        if self.changed_since:
+            return
+        self.index[test.id()] = self._current
+        self._current = set()
+
+    def finalize(self, result):
+        if self.changed_since:
+            return
+        sys.settrace(None)
+        threading.settrace(None)
+        save_index(self.index_file, self.index)
+
+    def report(self, stream):
+        if self.affected is not None:
+            stream.writeln('Skipped %s tests unaffected by changes since %s.'
+                           % (self.skipped, self.changed_since))
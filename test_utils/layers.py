@@ -0,0 +1,70 @@
+"""Fixtures for single tests, layered over a class's fixtures with savepoints.
+
+A test decorated with ``method_fixtures`` gets some more fixtures on top of
+its class's. They are loaded, uncommitted, after the class's fixtures, and a
+savepoint is taken before the test, so the test's own changes can be rolled
+back while the extra fixtures stay loaded for the next test wanting the same
+ones. So, to load each layer only once, put tests sharing method fixtures
+next to each other (unittest runs them in alphabetical order).
+
+On DBs without savepoints (like SQLite, under Django 1.3), the extra fixtures
+are loaded before every test wanting them and rolled back after it.
+
+"""
+from django.core.management import call_command
+from django.db import connections, transaction
+
+
+# DB alias -> the method fixtures currently loaded on top of the class's:
+_layers = {}
+
+
+def method_fixtures(*labels):
+    """Decorate a test method to load the fixtures ``labels`` for it on top
+    of its class's ``fixtures``."""
+    def decorator(f):
+        f.method_fixtures = labels
+        return f
+    return decorator
+
+
+def _uses_savepoints(db):
+    return connections[db].features.uses_savepoints
+
+
+def drop_layer(db):
+    """Roll back whatever method fixtures are loaded on DB ``db``."""
+    if _layers.pop(db, None):
+        transaction.rollback(using=db)
+
+
+def enter_layer(labels, databases):
+    """Make sure exactly the method fixtures ``labels`` are loaded, and
+    return a savepoint for each DB to roll back to after the test, or None
+    where a full rollback is needed."""
+    labels = tuple(labels or ())
+    savepoints = {}
+    for db in databases:
+        if _layers.get(db) != labels:
+            drop_layer(db)
+            if labels:
+                call_command('loaddata', *labels,
+                             **{'verbosity': 0, 'commit': False,
+                                'database': db})
+                if _uses_savepoints(db):
+                    _layers[db] = labels
+        savepoints[db] = (transaction.savepoint(using=db) if db in _layers
+                          else None)
+    return savepoints
+
+
+def exit_layer(savepoints):
+    """Roll back a test's changes, but not the method fixtures it shares
+    with the next test."""
+    for db, sid in savepoints.items():
+        if sid is None:
+            _layers.pop(db, None)
+            transaction.rollback(using=db)
+        else:
+            transaction.savepoint_rollback(sid, using=db)
+            transaction.savepoint_commit(sid, using=db)
@@ -0,0 +1,110 @@
+"""Run SQLite test DBs in memory, copied from a template kept on disk.
+
+With ``TEST_UTILS_SQLITE_IN_MEMORY`` on, ``RadicalTestSuiteRunner`` treats the
+on-disk test DB as a template: it is created (and fingerprinted, see
+``test_utils.schema``) as usual when missing or out of date, and otherwise
+left alone. Either way, it is then copied into an in-memory DB which the
+tests use, so commits don't wait on fsync and nothing the tests do is
+written to disk.
+
+The template is named after the DB's ``TEST_NAME`` if that is a file, or
+else ``test_<NAME>`` next to the DB itself.
+
+Since each connection to ``:memory:`` gets its own empty DB, tests which use
+the DB from other threads or processes won't see its contents.
+
+On Python 3.7+, the copy is made with SQLite's backup API. Older Pythons
+don't have that, so the template is attached to the in-memory DB and each
+table copied with a single ``INSERT ... SELECT``, which is still far quicker
+than replaying a dump row by row.
+
+"""
+import os
+import sqlite3
+
+from django.conf import settings
+
+
+def in_memory(connection):
+    """Return whether ``connection``'s test DB should be run in memory."""
+    return (getattr(settings, 'TEST_UTILS_SQLITE_IN_MEMORY', False) and
+            'sqlite' in connection.settings_dict['ENGINE'])
+
+
+def template_path(connection):
+    """Return the path of the on-disk template of ``connection``'s test
+    DB."""
+    test_name = connection.settings_dict.get('TEST_NAME')
+    if test_name and test_name != ':memory:':
+        return test_name
+    directory, name = os.path.split(connection.settings_dict['NAME'])
+    return os.path.join(directory, 'test_' + name)
+
+
+def use_template(connection):
+    """Have Django create ``connection``'s test DB as the template, and return
+    the template's path."""
+    path = template_path(connection)
+    connection.settings_dict['TEST_NAME'] = path
+    if isinstance(connection.settings_dict.get('TEST'), dict):
+        # Django 1.7+.
+        connection.settings_dict['TEST']['NAME'] = path
+    return path
+
+
+def discard_template(connection, path):
+    """Delete an out-of-date template so it can be created afresh without
+    Django asking whether it may."""
+    connection.close()
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _quote(name):
+    return '"%s"' % name.replace('"', '""')
+
+
+def _copy_attached(connection, path):
+    """Copy the DB at ``path`` into ``connection``'s empty DB, a table at a
+    time."""
+    connection.execute('ATTACH DATABASE ? AS template', (path,))
+    try:
+        schema = connection.execute(
+            "SELECT type, name, sql FROM template.sqlite_master "
+            "WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'").fetchall()
+        tables = [(name, sql) for type, name, sql in schema if type == 'table']
+        for name, sql in tables:
+            connection.execute(sql)
+            connection.execute('INSERT INTO main.%s SELECT * FROM template.%s'
+                               % (_quote(name), _quote(name)))
+        if connection.execute("SELECT COUNT(*) FROM template.sqlite_master "
+                              "WHERE name = 'sqlite_sequence'").fetchone()[0]:
+            # The counters may be past the highest IDs the rows went in with:
+            connection.execute('DELETE FROM main.sqlite_sequence')
+            connection.execute('INSERT INTO main.sqlite_sequence '
+                               'SELECT * FROM template.sqlite_sequence')
+        # Indexes are quicker to build after the rows are in, and triggers
+        # mustn't fire for the copying:
+        for type, name, sql in schema:
+            if type != 'table':
+                connection.execute(sql)
+        connection.commit()
+    finally:
+        connection.execute('DETACH DATABASE template')
+
+
+def copy_into_memory(connection, path):
+    """Point ``connection`` at a new in-memory DB holding a copy of the DB at
+    ``path``."""
+    connection.close()
+    connection.settings_dict['NAME'] = ':memory:'
+    connection.cursor()  # Connect.
+    source = sqlite3.connect(path)
+    try:
+        if hasattr(source, 'backup'):
+            # Python 3.7+: copy the pages directly.
+            source.backup(connection.connection)
+        else:
+            _copy_attached(connection.connection, path)
+    finally:
+        source.close()
@@ -0,0 +1,128 @@
+"""Give each of nose's ``--processes`` workers its own reusable test DBs.
+
+Nose's multiprocess plugin already spreads test classes across workers and
+merges their results back into one, but every worker would share the test DB
+the runner set up, and they'd trample each other's data. This plugin, which
+``RadicalTestSuiteRunner`` adds automatically, points each worker at its own
+copy instead, named after the runner's test DB plus a ``_w<n>`` suffix.
+
+Worker DBs aren't torn down afterward. Like the main test DB, each is reused
+on the next run unless it's missing, ``FORCE_DB`` is set, or its schema
+fingerprint is out of date.
+
+"""
+import fcntl
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.db import connections
+from django.utils.importlib import import_module
+from nose.plugins import Plugin
+
+from test_utils.schema import store_fingerprint
+from test_utils.sequences import reset_sequences
+
+
+# Worker-slot lock file, held open for the life of the worker:
+_slot_lock = None
+
+
+def worker_db_name(name, slot):
+    """Return the name of worker ``slot``'s copy of the test DB ``name``."""
+    # Keep any SQLite file extension on the end:
+    root, ext = os.path.splitext(name)
+    return '%s_w%s%s' % (root, slot, ext)
+
+
+def claim_slot():
+    """Return the lowest worker number not already in use by a live worker of
+    this project.
+
+    Slots are claimed with lock files so they stay stable from run to run,
+    and a restarted worker takes over its predecessor's DBs.
+
+    """
+    global _slot_lock
+    if _slot_lock is None:
+        project = hashlib.md5(os.getcwd()).hexdigest()[:8]
+        slot = 0
+        while True:
+            slot += 1
+            path = os.path.join(tempfile.gettempdir(),
+                                'test_utils_%s_w%s.lock' % (project, slot))
+            lock = open(path, 'a')
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                lock.close()
+                continue
+            _slot_lock = lock, slot
+            break
+    return _slot_lock[1]
+
+
+def _real_creation_class(connection):
+    backend = import_module(connection.__module__.rsplit('.', 1)[0] +
+                            '.creation')
+    return backend.DatabaseCreation
+
+
+def setup_worker_databases(slot):
+    """Point every connection at worker ``slot``'s DBs, creating any which
+    can't be reused."""
+    # The runner imports this module to find its plugins:
+    from test_utils.runner import should_create_database, skip_creation
+    for alias in connections:
+        connection = connections[alias]
+        # Don't share the parent process's socket:
+        connection.connection = None
+
+        main_db_name = connection.settings_dict['NAME']
+        if main_db_name == ':memory:':
+            # In-memory SQLite DBs are private to the process already, but
+            # they start out empty.
+            test_db_name = main_db_name
+        else:
+            test_db_name = worker_db_name(main_db_name, slot)
+        connection.settings_dict['TEST_NAME'] = test_db_name
+        connection.settings_dict['NAME'] = test_db_name
+
+        if (test_db_name != ':memory:' and
+            not should_create_database(connection)):
+            if getattr(settings, 'SQL_RESET_SEQUENCES', True):
+                reset_sequences(connection)
+            skip_creation(connection)
+        else:
+            # Connect to the main test DB to create ours:
+            connection.close()
+            connection.settings_dict['NAME'] = main_db_name
+            connection.creation.__class__ = _real_creation_class(connection)
+            connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            store_fingerprint(connection)
+
+
+class ParallelDatabasePlugin(Plugin):
+    """Set up per-worker test DBs when running with ``--processes``."""
+    name = 'parallel-databases'
+
+    def options(self, parser, env):
+        # Enabled by nose's own --processes option; nothing to add.
+        pass
+
+    def configure(self, options, conf):
+        self.conf = conf
+        self.enabled = (getattr(options, 'multiprocess_workers', 0) or 0) > 0
+        if self.enabled:
+            # The workers only get the plugins nose is told to make there.
+            from nose.plugins import multiprocess
+            if multiprocess._instantiate_plugins is None:
+                multiprocess._instantiate_plugins = []
+            if self.__class__ not in multiprocess._instantiate_plugins:
+                multiprocess._instantiate_plugins.append(self.__class__)
+
+    def begin(self):
+        # Nose calls this once in the main process and once in each worker.
+        if self.conf.worker:
+            setup_worker_databases(claim_slot())
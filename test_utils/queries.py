@@ -0,0 +1,119 @@
+"""Capture the queries a test runs, and hold it to a budget.
+
+Queries which differ only in their parameters (or in literals inlined into the
+SQL) are grouped together, so a query run once per row of something, the
+classic N+1 pattern, stands out.
+
+"""
+import re
+from functools import wraps
+
+from test_utils.cursors import add_cursor_observer, remove_cursor_observer
+
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN\s*\((?:\s*(?:%s|\?)\s*,?)+\)', re.IGNORECASE)
+
+
+def normalize(sql):
+    """Return ``sql`` with its literals and parameter lists boiled away, so
+    queries differing only in those look the same."""
+    sql = _NUMBER.sub('?', _STRING.sub('?', sql))
+    return _IN_LIST.sub('IN (...)', sql)
+
+
+class QueryCapture(object):
+    """Context manager which records the queries run against some DB aliases.
+
+    After the block, ``queries`` is a list of (alias, sql, params, duration)
+    tuples and ``time`` is the total seconds spent in them::
+
+        with QueryCapture(['default']) as capture:
+            self.client.get('/')
+        eq_(len(capture), 3)
+
+    """
+    def __init__(self, aliases):
+        self.aliases = list(aliases)
+        self.queries = []
+        self.time = 0
+        self._observers = {}
+
+    def __enter__(self):
+        for alias in self.aliases:
+            self._observers[alias] = self._observer(alias)
+            add_cursor_observer(alias, self._observers[alias])
+        return self
+
+    def __exit__(self, *exc_info):
+        for alias, observer in self._observers.items():
+            remove_cursor_observer(alias, observer)
+        self._observers = {}
+
+    def _observer(self, alias):
+        def observe(sql, params, duration, many):
+            self.queries.append((alias, sql, params, duration))
+            self.time += duration
+        return observe
+
+    def __len__(self):
+        return len(self.queries)
+
+    def repeated(self, minimum=2):
+        """Return (count, normalized SQL) for each kind of query run at least
+        ``minimum`` times, most frequent first."""
+        counts = {}
+        for alias, sql, params, duration in self.queries:
+            key = normalize(sql)
+            counts[key] = counts.get(key, 0) + 1
+        return sorted(((n, sql) for sql, n in counts.items() if n >= minimum),
+                      reverse=True)
+
+    def summary(self):
+        """Return a human-readable account of what was captured."""
+        lines = ['%s queries in %.1f ms' % (len(self), self.time * 1000)]
+        lines.extend('  %4sx %s' % (n, sql) for n, sql in self.repeated())
+        return '\n'.join(lines)
+
+
+def query_budget(queries=None, repeats=None):
+    """Decorate a test method to fail it if it runs more than ``queries``
+    queries, or the same kind of query more than ``repeats`` times.
+
+    Whichever of them is given overrides the class's ``query_budget`` or
+    ``query_repeat_limit``.
+
+    """
+    def decorator(f):
+        if queries is not None:
+            f.query_budget = queries
+        if repeats is not None:
+            f.query_repeat_limit = repeats
+        return f
+    return decorator
+
+
+def within_budget(test, method):
+    """Return ``method``, a test method of ``test``, wrapped to enforce its
+    query budget, or just ``method`` if it doesn't have one."""
+    budget = getattr(method, 'query_budget', test.query_budget)
+    repeat_limit = getattr(method, 'query_repeat_limit',
+                           test.query_repeat_limit)
+    if budget is None and repeat_limit is None:
+        return method
+
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        with QueryCapture(test._databases()) as capture:
+            result = method(*args, **kwargs)
+        if budget is not None and len(capture) > budget:
+            raise test.failureException(
+                'Query budget of %s exceeded: %s' %
+                (budget, capture.summary()))
+        if repeat_limit is not None and capture.repeated(repeat_limit + 1):
+            raise test.failureException(
+                'Same query run more than %s times (N+1?): %s' %
+                (repeat_limit, capture.summary()))
+        return result
+    return wrapper
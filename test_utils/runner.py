@@ -1,51 +1,154 @@
+from contextlib import contextmanager
+import optparse
 import os
+import sys
 
 from django.conf import settings
-from django.core.management.color import no_style
-from django.core.management.commands.loaddata import Command
-from django.db import connections, DEFAULT_DB_ALIAS
-from django.db.backends.mysql import creation as mysql
+from django.db import connections, DEFAULT_DB_ALIAS, transaction
+from django.utils.importlib import import_module
 
 import django_nose
 
+# Things needed only once tests are about to run are imported in the methods
+# that need them, so that merely importing the runner stays quick.
+from test_utils.dirty import skipped_count
+from test_utils.memory import (copy_into_memory, discard_template, in_memory,
+                               use_template)
+from test_utils.schema import schema_changed, store_fingerprint
+from test_utils.sequences import reset_sequences
+from test_utils.truncation import backend_name
+
 
 def uses_mysql(connection):
-    return 'mysql' in connection.settings_dict['ENGINE']
+    return backend_name(connection) == 'mysql'
+
+
+# loaddata's own handle(), saved when we replace it in setup_databases():
+_old_handle = None
+
+# How many times loaddata would have closed the connection after committing:
+_reconnects_saved = 0
+
+
+def saved_reconnects():
+    """Return how many reconnections loading fixtures has been spared."""
+    return _reconnects_saved
+
+
+def defer_constraints(connection):
+    """Put off checking foreign keys until the transaction commits, or, on
+    MySQL, which can't, turn the checks off until ``restore_constraints``.
+
+    SQLite is left alone: the Djangos we support don't turn its foreign key
+    checks on in the first place.
+
+    """
+    backend = backend_name(connection)
+    if backend == 'mysql':
+        connection.cursor().execute('SET foreign_key_checks = 0')
+    elif backend == 'postgresql':
+        connection.cursor().execute('SET CONSTRAINTS ALL DEFERRED')
+
+
+def restore_constraints(connection):
+    """Undo whatever of ``defer_constraints`` the end of the transaction
+    won't."""
+    if backend_name(connection) == 'mysql':
+        connection.cursor().execute('SET foreign_key_checks = 1')
 
 
-_old_handle = Command.handle
-def _foreign_key_ignoring_handle(self, *fixture_labels, **options):
-    """Wrap the the stock loaddata to ignore foreign key checks so we can load
-    circular references from fixtures.
+class _WatchedStream(object):
+    """Pass writes through to ``stream``, noting whether there were any."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.written = False
+
+    def write(self, text):
+        self.written = True
+        self.stream.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def _constraint_deferring_handle(self, *fixture_labels, **options):
+    """Wrap the the stock loaddata to defer foreign key checks until commit,
+    so we can load circular references from fixtures on any backend.
+
+    When it's told to commit, do that for it, so it doesn't close the
+    connection afterward and make the next query reconnect and rerun the
+    session setup statements.
+
+    Also, hand it the paths of the fixture files, looked up in our index,
+    rather than the labels, so it doesn't have to try opening every possible
+    file name in every fixture directory.
 
     This is monkeypatched into place in setup_databases().
 
     """
+    global _reconnects_saved
+    from test_utils.fixture_tables import find_fixture_files
+
     using = options.get('database', DEFAULT_DB_ALIAS)
     commit = options.get('commit', True)
     connection = connections[using]
 
-    if uses_mysql(connection):
-        cursor = connection.cursor()
-        cursor.execute('SET foreign_key_checks = 0')
-
-    _old_handle(self, *fixture_labels, **options)
-
-    if uses_mysql(connection):
-        cursor = connection.cursor()
-        cursor.execute('SET foreign_key_checks = 1')
-
+    paths = []
+    for label in fixture_labels:
+        files = find_fixture_files([label], using=using)
+        if files:
+            paths.extend(os.path.abspath(path) for path, _, _ in files)
+        else:
+            # Let loaddata complain about it in its own way.
+            paths.append(label)
+    fixture_labels = paths
+
+    if commit:
+        # Just what loaddata would do:
+        transaction.commit_unless_managed(using=using)
+        transaction.enter_transaction_management(using=using)
+        transaction.managed(True, using=using)
+    # When loading fails, loaddata (before Django 1.5) writes the error to
+    # stderr and returns instead of raising. Have it leave the traceback out
+    # of sys.stderr, so its stderr is where we'll hear of it.
+    stderr = self.stderr = _WatchedStream(getattr(self, 'stderr', sys.stderr))
+    try:
+        defer_constraints(connection)
+        try:
+            _old_handle(self, *fixture_labels,
+                        **dict(options, commit=False, traceback=False))
+        finally:
+            restore_constraints(connection)
+            self.stderr = stderr.stream
+        if stderr.written:
+            # Don't keep half a fixture.
+            if commit:
+                transaction.rollback(using=using)
+        elif commit:
+            # The deferred checks happen here, all at once:
+            transaction.commit(using=using)
+            _reconnects_saved += 1
+    except Exception:
+        if commit:
+            transaction.rollback(using=using)
+        raise
+    finally:
         if commit:
-            connection.close()
+            transaction.leave_transaction_management(using=using)
 
 
-class SkipDatabaseCreation(mysql.DatabaseCreation):
-    """Database creation class that skips both creation and flushing
+class SkipDatabaseCreation(object):
+    """Database creation mixin that skips both creation and flushing
 
     The idea is to re-use the perfectly good test DB already created by an
     earlier test run, cutting the time spent before any tests run from 5-13
     (depending on your I/O luck) down to 3.
 
+    It's mixed into each connection's own creation class by
+    ``skip_creation``, so no other backend's creation module (like MySQL's,
+    which wants MySQLdb) needs importing.
+
     """
     def create_test_db(self, verbosity=1, autoclobber=False, **kwargs):
         # Notice that the DB supports transactions. Originally, this was done
@@ -64,61 +167,158 @@ class SkipDatabaseCreation(mysql.DatabaseCreation):
         return self._get_test_db_name()
 
 
+# Creation class -> the same with SkipDatabaseCreation mixed in:
+_skipping_classes = {}
+
+
+def skip_creation(connection):
+    """Make ``connection``'s creation skip creating its test DB."""
+    cls = connection.creation.__class__
+    if issubclass(cls, SkipDatabaseCreation):
+        return
+    if cls not in _skipping_classes:
+        _skipping_classes[cls] = type('Skip' + cls.__name__,
+                                      (SkipDatabaseCreation, cls), {})
+    connection.creation.__class__ = _skipping_classes[cls]
+
+
+def should_create_database(connection):
+    """Return whether we should recreate the given DB.
+
+    This is true if the DB doesn't exist, if the FORCE_DB env var is truthy,
+    or if the models no longer match the fingerprint stored in the DB when it
+    was created.
+
+    """
+    # Notice whether the DB exists, and create it if it doesn't:
+    try:
+        connection.cursor()
+    except StandardError:  # TODO: Be more discerning but still DB
+                           # agnostic.
+        return True
+    if os.getenv('FORCE_DB', 'false').lower() not in ('false', '0', ''):
+        return True
+
+    # Notice when the Model classes (or migrations) change:
+    if getattr(settings, 'TEST_UTILS_CHECK_SCHEMA', True):
+        changed = schema_changed(connection)
+        if changed:
+            print ('Schema of "%s" is out of date (%s); recreating it.' %
+                   (connection.settings_dict['NAME'],
+                    ', '.join(changed[:5]) +
+                    (', ...' if len(changed) > 5 else '')))
+            return True
+    return False
+
+
+# The nose plugins RadicalTestSuiteRunner adds to django-nose's:
+PLUGINS = ['test_utils.bundling.FixtureBundlingPlugin',
+           'test_utils.history.HistoryPlugin',
+           'test_utils.impact.ImpactPlugin',
+           'test_utils.parallel.ParallelDatabasePlugin',
+           'test_utils.timing.TimingPlugin']
+
+
+def _plugin_class(path):
+    module, name = path.rsplit('.', 1)
+    return getattr(import_module(module), name)
+
+
+def _plugin_options():
+    """Return the optparse options of our plugins, for the ``test`` command
+    of django-nose versions which take them from the runner's ``options``."""
+    parser = optparse.OptionParser(add_help_option=False)
+    for path in PLUGINS:
+        _plugin_class(path)().addOptions(parser, os.environ)
+    return tuple(parser.option_list)
+
+
+def _new_options(existing, options):
+    """Return those of ``options`` whose flags aren't in ``existing``, like
+    when our plugins are listed in NOSE_PLUGINS too."""
+    taken = set(flag for option in existing
+                for flag in option._long_opts + option._short_opts)
+    return tuple(option for option in options
+                 if not taken & set(option._long_opts + option._short_opts))
+
+
+@contextmanager
+def _our_plugins():
+    """Add our plugins to NOSE_PLUGINS, where django-nose looks for extra
+    plugins to run and to take command line options for."""
+    old = getattr(settings, 'NOSE_PLUGINS', None)
+    plugins = list(old or [])
+    settings.NOSE_PLUGINS = plugins + [p for p in PLUGINS
+                                       if p not in plugins]
+    try:
+        yield
+    finally:
+        settings.NOSE_PLUGINS = old if old is not None else []
+
+
 class RadicalTestSuiteRunner(django_nose.NoseTestSuiteRunner):
     """This is a test runner that monkeypatches connection.creation to skip
     database creation if it appears that the DB already exists.  Your tests
     will run much faster.
 
+    A DB is rebuilt anyway if the models' schema no longer matches the
+    fingerprint it was created with. Turn that check off by setting
+    ``TEST_UTILS_CHECK_SCHEMA = False``.
+
+    With ``TEST_UTILS_SQLITE_IN_MEMORY = True``, SQLite test DBs are copied
+    from their reusable on-disk form into memory at startup, and the tests run
+    against the copies.
+
     To force the normal database creation, define the environment variable
     ``FORCE_DB``.  It doesn't really matter what the value is, we just check to
     see if it's there.
 
+    Pass ``--processes N`` to run the suite in N worker processes. Each worker
+    gets its own test DBs, which are reused between runs just like the main
+    ones.
+
+    Pass ``--with-bundle-fixtures`` to run classes with the same fixtures back
+    to back, loading those fixtures only once.
+
+    Pass ``--with-timing`` to get a JSON report of how long each test and
+    class spent in each phase of setup and teardown.
+
+    Pass ``--with-impact`` to record what each test depends on, and
+    ``--changed-since REV`` to run only the tests affected by changes since
+    the git revision REV.
+
+    Pass ``--shard i/M`` to run only the i-th of M shards of about equal
+    length, and ``--failed-first`` to run last run's failures first. Both
+    go by the class durations and outcomes remembered with
+    ``--with-history``.
+
     """
-    def setup_databases(self):
-        def should_create_database(connection):
-            """Return whether we should recreate the given DB.
-
-            This is true if the DB doesn't exist or if the FORCE_DB env var is
-            truthy.
-
-            """
-            # TODO: Notice when the Model classes change and return True. Worst
-            # case, we can generate sqlall and hash it, though it's a bit slow
-            # (2 secs) and hits the DB for no good reason. Until we find a
-            # faster way, I'm inclined to keep making people explicitly saying
-            # FORCE_DB if they want a new DB.
-
-            # Notice whether the DB exists, and create it if it doesn't:
-            try:
-                connection.cursor()
-            except StandardError:  # TODO: Be more discerning but still DB
-                                   # agnostic.
-                return True
-            return (os.getenv('FORCE_DB', 'false').lower()
-                    not in ('false', '0', ''))
-
-        def sql_reset_sequences(connection):
-            """Return a list of SQL statements needed to reset all sequences
-            for Django tables."""
-            # TODO: This is MySQL-specific--see below. It should also work with
-            # SQLite but not Postgres. :-(
-            tables = connection.introspection.django_table_names(
-                only_existing=True)
-            flush_statements = connection.ops.sql_flush(
-                no_style(), tables, connection.introspection.sequence_list())
-
-            # connection.ops.sequence_reset_sql() is not implemented for MySQL,
-            # and the base class just returns []. TODO: Implement it by pulling
-            # the relevant bits out of sql_flush().
-            return [s for s in flush_statements if s.startswith('ALTER')]
-            # Being overzealous and resetting the sequences on non-empty tables
-            # like django_content_type seems to be fine in MySQL: adding a row
-            # afterward does find the correct sequence number rather than
-            # crashing into an existing row.
+    # For older django-nose, whose test command adds the runner's options:
+    options = tuple(getattr(django_nose.NoseTestSuiteRunner, 'options', ()))
+    options += _new_options(options, _plugin_options())
+
+    @classmethod
+    def add_arguments(cls, parser):
+        # Newer django-nose builds the test command's arguments from the
+        # plugins in NOSE_PLUGINS.
+        with _our_plugins():
+            super(RadicalTestSuiteRunner, cls).add_arguments(parser)
 
+    def run_suite(self, nose_argv):
+        with _our_plugins():
+            return super(RadicalTestSuiteRunner, self).run_suite(nose_argv)
+
+    def setup_databases(self):
+        global _old_handle
+        created = []
+        templates = {}
+        reused = []
         for alias in connections:
             connection = connections[alias]
             creation = connection.creation
+            if in_memory(connection):
+                # The test DB on disk becomes the template of one in memory:
+                templates[alias] = use_template(connection)
             test_db_name = creation._get_test_db_name()
 
             # Mess with the DB name so other things operate on a test DB
@@ -131,28 +331,47 @@ class RadicalTestSuiteRunner(django_nose.NoseTestSuiteRunner):
                 print ('Reusing old database "%s". Set env var FORCE_DB=1 if '
                        'you need fresh DBs.' % test_db_name)
 
-                if getattr(settings, 'SQL_RESET_SEQUENCES', True):
-                    # Reset auto-increment sequences. Apparently, SUMO's tests
-                    # are horrid and coupled to certain numbers.
-                    cursor = connection.cursor()
-                    for statement in sql_reset_sequences(connection):
-                        cursor.execute(statement)
-                    connection.commit_unless_managed()  # which it is
-
-                creation.__class__ = SkipDatabaseCreation
+                reused.append(alias)
+                skip_creation(connection)
             else:
                 # We're not using SkipDatabaseCreation, so put the DB name
                 # back.
                 connection.settings_dict['NAME'] = orig_db_name
+                if alias in templates:
+                    discard_template(connection, templates[alias])
+                created.append(alias)
 
-        Command.handle = _foreign_key_ignoring_handle
+        from django.core.management.commands.loaddata import Command
+        if Command.handle is not _constraint_deferring_handle:
+            _old_handle = Command.handle
+            Command.handle = _constraint_deferring_handle
 
         # With our class patch, does nothing but return some connection
         # objects:
-        return super(RadicalTestSuiteRunner, self).setup_databases()
+        old_config = super(RadicalTestSuiteRunner, self).setup_databases()
+
+        # Remember what the new DBs look like so the next run can tell whether
+        # they're still good:
+        for alias in created:
+            store_fingerprint(connections[alias])
+
+        for alias, path in templates.items():
+            copy_into_memory(connections[alias], path)
+
+        if getattr(settings, 'SQL_RESET_SEQUENCES', True):
+            # Reset auto-increment sequences. Apparently, SUMO's tests are
+            # horrid and coupled to certain numbers. (In-memory DBs get theirs
+            # reset in the copy, leaving the template alone.)
+            for alias in reused:
+                reset_sequences(connections[alias])
+        return old_config
 
     def teardown_databases(self, old_config, **kwargs):
         """Leave those poor, reusable databases alone."""
+        skipped = skipped_count()
+        if skipped and self.verbosity >= 1:
+            print ('Dirty-table tracking skipped %s table truncations.' %
+                   skipped)
 
     def setup_test_environment(self, **kwargs):
         # If we have a settings_test.py let's roll it into our settings.
@@ -0,0 +1,192 @@
+"""Cheap fingerprints of the schema Django would create for a database.
+
+The fingerprint is computed from model ``_meta`` and the migration files on
+disk, without touching the DB, and is stored in a little metadata table inside
+the test DB when it's created. On later runs, ``RadicalTestSuiteRunner``
+compares the two to notice that models have changed since the DB was built.
+
+"""
+import hashlib
+import os
+
+from django.db import DatabaseError, router, transaction
+from django.db.models import get_apps, get_models
+from django.utils.importlib import import_module
+
+
+#: Name of the table, inside each test DB, which remembers its fingerprint
+METADATA_TABLE = 'test_utils_schema'
+
+# Key of the row holding the fingerprint of the whole schema:
+_ALL = '__all__'
+
+# DB alias -> fingerprint of the whole schema, computed once per process:
+_schema_hashes = {}
+
+# Prefix of the rows for tables created outside the usual schema, like those
+# of ExtraAppTestCase's extra apps:
+EXTRA_PREFIX = 'extra:'
+
+
+def _field_description(field, connection):
+    rel = getattr(field, 'rel', None)
+    return (field.name,
+            field.column,
+            field.db_type(connection=connection),
+            field.null,
+            field.unique,
+            field.db_index,
+            field.primary_key,
+            rel and rel.to._meta.db_table)
+
+
+def _model_description(model, connection):
+    opts = model._meta
+    return (opts.db_table,
+            opts.db_tablespace,
+            [_field_description(f, connection) for f in opts.local_fields],
+            sorted(opts.unique_together),
+            sorted(getattr(opts, 'index_together', ())))
+
+
+def _app_directory(models_module):
+    """Return the directory of the app whose models are ``models_module``,
+    which may be a ``models`` package rather than a module."""
+    if '.' not in models_module.__name__:
+        return os.path.dirname(models_module.__file__)
+    package = import_module(models_module.__name__.rsplit('.', 1)[0])
+    return os.path.dirname(package.__file__)
+
+
+def _migration_files():
+    """Return (name, hash of contents) for all the migration modules on disk.
+
+    Works for both South and Django's built-in migrations, since both keep
+    them in a ``migrations`` package in the app.
+
+    """
+    files = []
+    for app in get_apps():
+        directory = os.path.join(_app_directory(app), 'migrations')
+        if not os.path.isdir(directory):
+            continue
+        for name in os.listdir(directory):
+            if name.endswith('.py'):
+                with open(os.path.join(directory, name), 'rb') as f:
+                    files.append((os.path.join(app.__name__, name),
+                                  hashlib.sha1(f.read()).hexdigest()))
+    return sorted(files)
+
+
+def _hash(thing):
+    return hashlib.sha1(repr(thing)).hexdigest()
+
+
+def model_fingerprint(model, connection):
+    """Return a hash of the definition of ``model``'s table."""
+    return _hash(_model_description(model, connection))
+
+
+def schema_fingerprint(connection):
+    """Return a dict mapping each table Django would create on ``connection``
+    to a hash of its definition.
+
+    The hash of the whole schema, including migration state, is under the key
+    ``'__all__'``.
+
+    """
+    alias = connection.alias
+    fingerprints = {}
+    for model in get_models(include_auto_created=True):
+        if router.allow_syncdb(alias, model):
+            fingerprints[model._meta.db_table] = model_fingerprint(
+                model, connection)
+    fingerprints[_ALL] = _hash((sorted(fingerprints.items()),
+                                _migration_files()))
+    return fingerprints
+
+
+def schema_hash(connection):
+    """Return the fingerprint of the whole schema for ``connection``,
+    computing it only once per process.
+
+    Handy for keying caches that mustn't outlive a model change.
+
+    """
+    if connection.alias not in _schema_hashes:
+        _schema_hashes[connection.alias] = schema_fingerprint(connection)[_ALL]
+    return _schema_hashes[connection.alias]
+
+
+def stored_fingerprint(connection):
+    """Return the fingerprint dict saved in the DB, or None if there isn't
+    one."""
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    try:
+        cursor.execute('SELECT name, fingerprint FROM %s' %
+                       qn(METADATA_TABLE))
+        return dict(cursor.fetchall())
+    except DatabaseError:
+        # Postgres won't let us do anything else in an aborted transaction:
+        transaction.rollback_unless_managed(using=connection.alias)
+        return None
+
+
+def store_fingerprint(connection, fingerprints=None):
+    """Save the current schema's fingerprint into the DB, and commit."""
+    if fingerprints is None:
+        fingerprints = schema_fingerprint(connection)
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    if stored_fingerprint(connection) is None:
+        cursor.execute('CREATE TABLE %s (name VARCHAR(255) NOT NULL PRIMARY '
+                       'KEY, fingerprint VARCHAR(40) NOT NULL)' %
+                       qn(METADATA_TABLE))
+    else:
+        cursor.execute('DELETE FROM %s' % qn(METADATA_TABLE))
+    cursor.executemany('INSERT INTO %s (name, fingerprint) VALUES (%%s, %%s)' %
+                       qn(METADATA_TABLE), fingerprints.items())
+    connection.commit_unless_managed()
+
+
+def store_extra_fingerprints(connection, fingerprints):
+    """Save the fingerprints of some extra tables, keyed by table name, into
+    the DB alongside the schema's, and commit."""
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    names = [EXTRA_PREFIX + table for table in fingerprints]
+    cursor.execute('DELETE FROM %s WHERE name IN (%s)' %
+                   (qn(METADATA_TABLE), ', '.join(['%s'] * len(names))),
+                   names)
+    cursor.executemany('INSERT INTO %s (name, fingerprint) VALUES (%%s, %%s)' %
+                       qn(METADATA_TABLE),
+                       [(EXTRA_PREFIX + table, fingerprint)
+                        for table, fingerprint in fingerprints.items()])
+    connection.commit_unless_managed()
+
+
+def changed_tables(old, new):
+    """Return the sorted names of tables which were added, removed, or
+    altered between two fingerprint dicts."""
+    return sorted(t for t in set(old) | set(new)
+                  if t != _ALL and not t.startswith(EXTRA_PREFIX) and
+                  old.get(t) != new.get(t))
+
+
+def schema_changed(connection):
+    """Return the list of changed tables if the DB's schema doesn't match the
+    models, [] if it does.
+
+    A DB with no stored fingerprint counts as changed, with every table
+    listed, since we can't vouch for it.
+
+    """
+    current = schema_fingerprint(connection)
+    stored = stored_fingerprint(connection)
+    if stored is None:
+        return changed_tables({}, current) or [_ALL]
+    if stored.get(_ALL) == current[_ALL]:
+        return []
+    # Migrations may have changed even though no table definition did:
+    return changed_tables(stored, current) or [_ALL]
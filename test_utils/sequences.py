@@ -0,0 +1,166 @@
+"""Reset the auto-increment counters of a reused test DB.
+
+Some test suites are coupled to the IDs their objects get, so a reused DB's
+counters must start where a fresh DB's would: just past the highest ID left
+in each table (the rows of ``django_content_type`` and the like). Only
+counters which have moved past that point are reset, and looking for them
+costs a query or two per hundred tables:
+
+* PostgreSQL: the sequences are found with ``pg_get_serial_sequence`` and all
+  the moved ones are reset with a single ``SELECT setval(...), ...``.
+* SQLite: counters live in ``sqlite_sequence`` (for ``AUTOINCREMENT`` tables
+  only; others go by the highest rowid anyway) and are fixed with a single
+  ``UPDATE``.
+* MySQL: counters come from ``information_schema``, and each moved one needs
+  its own ``ALTER TABLE``, since MySQL has no way to batch them.
+
+Other backends are left alone.
+
+"""
+from django.db import router
+from django.db.models import AutoField, get_models
+
+from test_utils.truncation import backend_name
+
+
+# Max number of tables to look at with a single query:
+BATCH_SIZE = 100
+
+
+def _batches(items):
+    items = list(items)
+    for start in range(0, len(items), BATCH_SIZE):
+        yield items[start:start + BATCH_SIZE]
+
+
+def auto_columns(connection):
+    """Return a dict mapping each existing table with an auto-incrementing
+    primary key to that key's column."""
+    existing = set(connection.introspection.table_names())
+    columns = {}
+    for model in get_models(include_auto_created=True):
+        opts = model._meta
+        if (isinstance(opts.pk, AutoField) and opts.db_table in existing and
+            router.allow_syncdb(connection.alias, model)):
+            columns[opts.db_table] = opts.pk.column
+    return columns
+
+
+def max_ids(connection, cursor, columns):
+    """Return the highest ID, or 0, in each of ``columns``' tables."""
+    qn = connection.ops.quote_name
+    ids = {}
+    for batch in _batches(sorted(columns)):
+        cursor.execute(' UNION ALL '.join(
+            'SELECT %%s, MAX(%s) FROM %s' % (qn(columns[table]), qn(table))
+            for table in batch), batch)
+        ids.update((table, id or 0) for table, id in cursor.fetchall())
+    return ids
+
+
+def _postgresql_counters(connection, cursor, columns):
+    sequences = {}
+    for batch in _batches(sorted(columns)):
+        params = []
+        for table in batch:
+            params.extend([table, '"%s"' % table, columns[table]])
+        cursor.execute(' UNION ALL '.join(
+            ['SELECT %s, pg_get_serial_sequence(%s, %s)'] * len(batch)),
+            params)
+        sequences.update((table, seq) for table, seq in cursor.fetchall()
+                         if seq)
+    counters = {}
+    for batch in _batches(sorted(sequences)):
+        cursor.execute(' UNION ALL '.join(
+            'SELECT %%s, last_value, is_called FROM %s' % sequences[table]
+            for table in batch), batch)
+        counters.update((table, value if called else value - 1)
+                        for table, value, called in cursor.fetchall())
+    return counters, sequences
+
+
+def _postgresql_reset(connection, cursor, ids, sequences):
+    setvals, params = [], []
+    for table, id in sorted(ids.items()):
+        setvals.append('setval(%s, %s, %s)')
+        # An empty table's sequence should hand out 1 next:
+        params.extend([sequences[table], max(id, 1), bool(id)])
+    cursor.execute('SELECT ' + ', '.join(setvals), params)
+
+
+def _sqlite_counters(connection, cursor, columns):
+    cursor.execute("SELECT COUNT(*) FROM sqlite_master "
+                   "WHERE name = 'sqlite_sequence'")
+    if not cursor.fetchone()[0]:
+        # No AUTOINCREMENT tables at all.
+        return {}, None
+    cursor.execute('SELECT name, seq FROM sqlite_sequence')
+    return dict((table, seq) for table, seq in cursor.fetchall()
+                if table in columns), None
+
+
+def _sqlite_reset(connection, cursor, ids, extra):
+    cases, params = [], []
+    for table, id in sorted(ids.items()):
+        cases.append('WHEN %s THEN %s')
+        params.extend([table, id])
+    params.extend(sorted(ids))
+    cursor.execute('UPDATE sqlite_sequence SET seq = CASE name %s END '
+                   'WHERE name IN (%s)' %
+                   (' '.join(cases), ', '.join(['%s'] * len(ids))), params)
+
+
+def _mysql_counters(connection, cursor, columns):
+    cursor.execute('SELECT TABLE_NAME, AUTO_INCREMENT '
+                   'FROM information_schema.TABLES '
+                   'WHERE TABLE_SCHEMA = DATABASE() '
+                   'AND AUTO_INCREMENT IS NOT NULL')
+    return dict((table, next_id - 1) for table, next_id in cursor.fetchall()
+                if table in columns), None
+
+
+def _mysql_reset(connection, cursor, ids, extra):
+    qn = connection.ops.quote_name
+    for table, id in sorted(ids.items()):
+        cursor.execute('ALTER TABLE %s AUTO_INCREMENT = %d' %
+                       (qn(table), id + 1))
+
+
+_ENGINES = {
+    'postgresql': (_postgresql_counters, _postgresql_reset),
+    'sqlite': (_sqlite_counters, _sqlite_reset),
+    'mysql': (_mysql_counters, _mysql_reset),
+}
+
+
+def moved_sequences(connection):
+    """Return a dict of the tables whose counters have moved past their
+    highest ID, mapped to that ID, along with whatever the backend's reset
+    needs to know."""
+    engine = _ENGINES.get(backend_name(connection))
+    if not engine:
+        return {}, None
+    columns = auto_columns(connection)
+    cursor = connection.cursor()
+    counters, extra = engine[0](connection, cursor, columns)
+    # Counters still at their start can't have moved past anything:
+    used = dict((table, columns[table]) for table, counter in counters.items()
+                if counter > 0)
+    ids = max_ids(connection, cursor, used)
+    return (dict((table, id) for table, id in ids.items()
+                 if counters[table] > id),
+            extra)
+
+
+def reset_sequences(connection):
+    """Reset the counters of a reused DB which have moved on, and commit.
+
+    Return how many were reset.
+
+    """
+    ids, extra = moved_sequences(connection)
+    if ids:
+        _ENGINES[backend_name(connection)][1](connection, connection.cursor(),
+                                               ids, extra)
+    connection.commit_unless_managed()
+    return len(ids)
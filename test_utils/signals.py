@@ -4,3 +4,8 @@ import django.dispatch
 # test set-up and teardown signals, allowing other apps to perform cleanup etc.
 pre_setup = django.dispatch.Signal()
 post_teardown = django.dispatch.Signal()
+
+# Sent with the ``phase``, ``duration`` (in seconds), and ``test`` (or None for
+# class-level phases) each time a test case finishes a phase of its lifecycle,
+# if anybody's listening. See test_utils.timing.
+phase_timed = django.dispatch.Signal()
@@ -0,0 +1,187 @@
+"""Snapshots of the DB right after a set of fixtures is loaded, so the next
+class wanting the same fixtures can copy the rows back in bulk rather than
+running loaddata again.
+
+A snapshot is a set of shadow tables, one per table the fixtures wrote to,
+living in the test DB alongside the real ones. Since the test DB is reused,
+so are the snapshots, from run to run. They're keyed on the fixture labels and
+the contents of the fixture files, so editing a fixture just means a new
+snapshot. The least recently used snapshots are dropped once they hold more
+than ``TEST_UTILS_SNAPSHOT_MAX_ROWS`` rows altogether.
+
+Snapshots are only taken of tables which were empty before the fixtures were
+loaded, and only restored into tables which are empty, so rows that came from
+anywhere else are never copied, duplicated, or lost.
+
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.management.color import no_style
+from django.db import connections, DatabaseError, transaction
+from django.db.models import get_models
+
+from test_utils.fixture_tables import content_hash, find_fixture_files
+from test_utils.schema import schema_hash
+from test_utils.truncation import backend_name, row_counts
+
+
+#: Name of the table, inside each test DB, which lists the snapshots
+REGISTRY_TABLE = 'test_utils_snapshot'
+
+# DB alias -> {snapshot key: {'tables': [(table, shadow)], 'rows': n,
+#                             'used': timestamp}}
+_registries = {}
+
+# Aliases whose DB has a registry table:
+_has_registry_table = set()
+
+
+def snapshot_key(fixture_labels, using):
+    """Return the key of the snapshot for these fixtures as they are now, or
+    None if they can't be found."""
+    files = find_fixture_files(fixture_labels, using=using)
+    if not files:
+        return None
+    # Include the schema, so a snapshot can't outlive a model change even if
+    # the DB does:
+    key = hashlib.sha1(repr((using, sorted(fixture_labels),
+                             schema_hash(connections[using]))))
+    for path, format, compression_format in sorted(files):
+        key.update(content_hash(path))
+    return key.hexdigest()
+
+
+def _registry(connection):
+    """Return the snapshot registry for ``connection``, reading it from the
+    DB the first time."""
+    if connection.alias not in _registries:
+        registry = {}
+        cursor = connection.cursor()
+        try:
+            cursor.execute('SELECT snapshot_key, source_table, shadow_table, '
+                           'row_count, last_used FROM %s' %
+                           connection.ops.quote_name(REGISTRY_TABLE))
+        except DatabaseError:
+            # No snapshots yet. Postgres needs a clean slate to go on:
+            transaction.rollback(using=connection.alias)
+        else:
+            _has_registry_table.add(connection.alias)
+            for key, table, shadow, rows, used in cursor.fetchall():
+                entry = registry.setdefault(key, {'tables': [], 'rows': 0,
+                                                  'used': used})
+                entry['tables'].append((table, shadow))
+                entry['rows'] += rows
+        _registries[connection.alias] = registry
+    return _registries[connection.alias]
+
+
+def empty_tables(using, tables):
+    """Return which of ``tables`` have no rows."""
+    counts = row_counts(connections[using], tables, 1)
+    return set(table for table in tables if not counts.get(table))
+
+
+def _reset_sequences(connection, tables):
+    models = [m for m in get_models(include_auto_created=True)
+              if m._meta.db_table in tables]
+    cursor = connection.cursor()
+    for statement in connection.ops.sequence_reset_sql(no_style(), models):
+        cursor.execute(statement)
+
+
+def restore_snapshot(fixture_labels, using):
+    """Put the tables back the way they were right after these fixtures were
+    last loaded.
+
+    Return False, having done nothing, if there's no snapshot to restore or
+    its tables aren't empty. Leaves the transaction uncommitted.
+
+    """
+    connection = connections[using]
+    key = snapshot_key(fixture_labels, using)
+    entry = _registry(connection).get(key)
+    if not entry:
+        return False
+    tables = [table for table, _ in entry['tables']]
+    if len(empty_tables(using, tables)) < len(tables):
+        return False
+
+    qn = connection.ops.quote_name
+    mysql = backend_name(connection) == 'mysql'
+    cursor = connection.cursor()
+    if mysql:
+        cursor.execute('SET FOREIGN_KEY_CHECKS=0')
+    for table, shadow in entry['tables']:
+        cursor.execute('INSERT INTO %s SELECT * FROM %s' %
+                       (qn(table), qn(shadow)))
+    if mysql:
+        cursor.execute('SET FOREIGN_KEY_CHECKS=1')
+    # Rows came back with their primary keys, which Postgres' sequences don't
+    # notice:
+    _reset_sequences(connection, tables)
+
+    entry['used'] = time.time()
+    cursor.execute('UPDATE %s SET last_used = %%s WHERE snapshot_key = %%s' %
+                   qn(REGISTRY_TABLE), [entry['used'], key])
+    return True
+
+
+def _drop(connection, key):
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    for table, shadow in _registry(connection).pop(key)['tables']:
+        cursor.execute('DROP TABLE IF EXISTS %s' % qn(shadow))
+    cursor.execute('DELETE FROM %s WHERE snapshot_key = %%s' %
+                   qn(REGISTRY_TABLE), [key])
+
+
+def take_snapshot(fixture_labels, using, tables):
+    """Copy ``tables``, as just loaded from these fixtures, into a snapshot,
+    evicting old snapshots as necessary to stay within the row limit.
+
+    Commits, since DDL does on some backends anyway.
+
+    """
+    connection = connections[using]
+    key = snapshot_key(fixture_labels, using)
+    registry = _registry(connection)
+    if not key or key in registry or not tables:
+        return
+
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    if connection.alias not in _has_registry_table:
+        cursor.execute('CREATE TABLE %s (snapshot_key VARCHAR(40) NOT NULL, '
+                       'source_table VARCHAR(255) NOT NULL, shadow_table '
+                       'VARCHAR(255) NOT NULL, row_count INTEGER NOT NULL, '
+                       'last_used DOUBLE PRECISION NOT NULL)' %
+                       qn(REGISTRY_TABLE))
+        _has_registry_table.add(connection.alias)
+
+    entry = {'tables': [], 'rows': 0, 'used': time.time()}
+    for i, table in enumerate(sorted(tables)):
+        shadow = 'test_utils_snap_%s_%s' % (key[:12], i)
+        # Clean up after any run which died halfway through this:
+        cursor.execute('DROP TABLE IF EXISTS %s' % qn(shadow))
+        cursor.execute('CREATE TABLE %s AS SELECT * FROM %s' %
+                       (qn(shadow), qn(table)))
+        cursor.execute('SELECT COUNT(*) FROM %s' % qn(shadow))
+        rows = cursor.fetchone()[0]
+        cursor.execute('INSERT INTO %s (snapshot_key, source_table, '
+                       'shadow_table, row_count, last_used) VALUES '
+                       '(%%s, %%s, %%s, %%s, %%s)' % qn(REGISTRY_TABLE),
+                       [key, table, shadow, rows, entry['used']])
+        entry['tables'].append((table, shadow))
+        entry['rows'] += rows
+
+    limit = getattr(settings, 'TEST_UTILS_SNAPSHOT_MAX_ROWS', 1000000)
+    total = sum(e['rows'] for e in registry.values()) + entry['rows']
+    for old_key in sorted(registry, key=lambda k: registry[k]['used']):
+        if total <= limit:
+            break
+        total -= registry[old_key]['rows']
+        _drop(connection, old_key)
+    registry[key] = entry
+    transaction.commit(using=using)
@@ -0,0 +1,111 @@
+"""Jinja2 render instrumentation for Django's test client and friends.
+
+Django's test client learns which templates a view rendered, and with what
+context, by listening to the ``template_rendered`` signal, which Jinja2 knows
+nothing about. We teach it, but only while something is listening: the
+instrumented ``render`` is swapped into place when a receiver connects to the
+signal and swapped back out when the last one disconnects, so renders cost
+nothing extra the rest of the time.
+
+The context is handed over as a lazy, read-only view rather than a copy, and
+``TEST_UTILS_TEMPLATE_HISTORY`` caps how many renders are reported after each
+receiver connects (the test client connects once per request), for pages
+which render templates by the thousand.
+
+"""
+from collections import Mapping
+
+from django.conf import settings
+from django.dispatch import Signal
+from django.test import signals
+
+# Imported by instrument_jinja(), so projects without Jinja2, or which never
+# run tests, don't pay for it:
+jinja2 = None
+
+# The uninstrumented Template.render:
+_old_render = None
+
+# How many more renders to report before going quiet, or None for no limit:
+_remaining = None
+
+
+class ContextView(Mapping):
+    """Read-only view of the context passed to ``Template.render``.
+
+    The arguments are only combined into a dict if somebody looks.
+
+    """
+    def __init__(self, args, kwargs):
+        self._args = args
+        self._kwargs = kwargs
+        self._dict = None
+
+    @property
+    def _data(self):
+        if self._dict is None:
+            self._dict = dict(*self._args, **self._kwargs)
+        return self._dict
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return repr(self._data)
+
+
+def instrumented_render(self, *args, **kwargs):
+    global _remaining
+    if _remaining is None or _remaining > 0:
+        if _remaining is not None:
+            _remaining -= 1
+        signals.template_rendered.send(sender=self, template=self,
+                                       context=ContextView(args, kwargs))
+    return _old_render(self, *args, **kwargs)
+
+
+def _update_instrumentation():
+    """Instrument rendering iff anybody's listening."""
+    if signals.template_rendered.receivers:
+        jinja2.Template.render = instrumented_render
+    else:
+        jinja2.Template.render = _old_render
+
+
+def _connect(*args, **kwargs):
+    global _remaining
+    Signal.connect(signals.template_rendered, *args, **kwargs)
+    _remaining = getattr(settings, 'TEST_UTILS_TEMPLATE_HISTORY', None)
+    _update_instrumentation()
+
+
+def _disconnect(*args, **kwargs):
+    result = Signal.disconnect(signals.template_rendered, *args, **kwargs)
+    _update_instrumentation()
+    return result
+
+
+def instrument_jinja():
+    """Start reporting Jinja2 renders through ``template_rendered`` whenever
+    it has receivers.
+
+    Does nothing if Jinja2 isn't installed or this has been done already.
+
+    """
+    global _old_render, jinja2
+    if _old_render is not None:
+        return
+    try:
+        import jinja2
+    except ImportError:
+        return
+    _old_render = jinja2.Template.render
+    signals.template_rendered.connect = _connect
+    signals.template_rendered.disconnect = _disconnect
+    _update_instrumentation()
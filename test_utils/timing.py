@@ -0,0 +1,140 @@
+"""Timing of each phase of our test cases' lifecycles.
+
+The phases are ``setup_class`` (where fixtures are loaded), ``pre_setup``,
+``test`` (the test method, with its setUp and tearDown), ``post_teardown``
+(where the transaction is rolled back), and ``teardown_class`` (where tables
+are emptied). Each is reported through ``signals.phase_timed``, but only
+while somebody's connected to it, so the cost is a few microseconds a test.
+
+``TimingPlugin``, which ``RadicalTestSuiteRunner`` provides, collects the
+timings into a JSON report and prints the slowest setups and teardowns.
+Enable it with ``--with-timing``.
+
+"""
+import json
+from functools import wraps
+from time import time
+
+from nose.plugins import Plugin
+
+from test_utils import signals
+
+
+def timed(phase):
+    """Decorate a test case method (or the function inside a classmethod) to
+    report how long ``phase`` took.
+
+    When overrides of the same method call each other through ``super``,
+    only the outermost is timed.
+
+    """
+    flag = '_timing_%s' % phase
+
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if (not signals.phase_timed.receivers or
+                getattr(self, flag, False)):
+                return method(self, *args, **kwargs)
+
+            start = time()
+            if phase == 'post_teardown' and hasattr(self, '_timing_test'):
+                _send(self, 'test', start - self._timing_test)
+                del self._timing_test
+            setattr(self, flag, True)
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                delattr(self, flag)
+                end = time()
+                _send(self, phase, end - start)
+                if phase == 'pre_setup':
+                    self._timing_test = end
+        return wrapper
+    return decorator
+
+
+def _send(obj, phase, duration):
+    if isinstance(obj, type):
+        cls, test = obj, None
+    else:
+        cls, test = obj.__class__, obj
+    signals.phase_timed.send(sender=cls, phase=phase, duration=duration,
+                             test=test)
+
+
+def _class_name(cls):
+    return '%s.%s' % (cls.__module__, cls.__name__)
+
+
+class TimingPlugin(Plugin):
+    """Write a JSON report of how long each phase of each test and class took,
+    and list the slowest setups and teardowns."""
+    name = 'timing'
+
+    def options(self, parser, env):
+        super(TimingPlugin, self).options(parser, env)
+        parser.add_option('--timing-file', dest='timing_file',
+                          default=env.get('NOSE_TIMING_FILE', 'timing.json'),
+                          help='Where to write the JSON timing report '
+                               '[NOSE_TIMING_FILE]')
+        parser.add_option('--timing-top', dest='timing_top', type='int',
+                          default=env.get('NOSE_TIMING_TOP', 10),
+                          help='How many of the slowest setups and teardowns '
+                               'to list [NOSE_TIMING_TOP]')
+
+    def configure(self, options, conf):
+        super(TimingPlugin, self).configure(options, conf)
+        self.report_file = options.timing_file
+        self.top = options.timing_top
+        self.classes = {}
+        self.tests = {}
+
+    def begin(self):
+        signals.phase_timed.connect(self.record)
+
+    def record(self, sender, phase, duration, test, **kwargs):
+        name = _class_name(sender)
+        if test is None:
+            entry = self.classes.setdefault(
+                name, {'fixtures': list(getattr(sender, 'fixtures', None)
+                                        or [])})
+        else:
+            entry = self.tests.setdefault(test.id(), {'class': name})
+        entry[phase] = entry.get(phase, 0) + duration
+
+    def _tables(self):
+        """Add the tables each class's fixtures use to the report."""
+        from test_utils.fixture_tables import tables_used_by_fixtures
+        for entry in self.classes.values():
+            entry['tables'] = sorted(
+                tables_used_by_fixtures(entry['fixtures']))
+
+    def report(self, stream):
+        signals.phase_timed.disconnect(self.record)
+        self._tables()
+        from test_utils.runner import saved_reconnects
+        reconnects = saved_reconnects()
+        with open(self.report_file, 'w') as f:
+            json.dump({'classes': self.classes, 'tests': self.tests,
+                       'saved_reconnects': reconnects}, f,
+                      indent=2, sort_keys=True)
+
+        timings = []
+        for name, entry in self.classes.items():
+            for phase in ('setup_class', 'teardown_class'):
+                if phase in entry:
+                    timings.append((entry[phase], phase, name))
+        for name, entry in self.tests.items():
+            for phase in ('pre_setup', 'post_teardown'):
+                if phase in entry:
+                    timings.append((entry[phase], phase, name))
+        timings.sort(reverse=True)
+
+        stream.writeln('Slowest setups and teardowns:')
+        for duration, phase, name in timings[:self.top]:
+            stream.writeln('%8.3fs  %-15s %s' % (duration, phase, name))
+        if reconnects:
+            stream.writeln('Kept the DB connection open after %s fixture '
+                           'loads, saving as many reconnects.' % reconnects)
+        stream.writeln('Full timings written to %s' % self.report_file)
@@ -0,0 +1,101 @@
+"""Share translation catalogs between tests rather than reloading them all.
+
+Django caches each language's catalog in ``trans_real._translations`` but
+never clears it, so we used to throw the whole cache away before every test,
+and every locale a test touched was parsed from its .mo files again. Instead,
+we keep a pristine copy of every catalog loaded, restore it before each test,
+and put back any catalog a test modified. Catalogs notice their own
+modification, so checking costs next to nothing.
+
+"""
+from django.conf import settings
+from django.utils.translation import trans_real
+
+
+class WatchedCatalog(dict):
+    """A catalog which notes whether it's been written to."""
+    dirty = False
+
+
+def _dirtying(name):
+    method = getattr(dict, name)
+
+    def dirtying(self, *args, **kwargs):
+        self.dirty = True
+        return method(self, *args, **kwargs)
+    dirtying.__name__ = name
+    return dirtying
+
+for _name in ('__setitem__', '__delitem__', 'clear', 'pop', 'popitem',
+              'setdefault', 'update'):
+    setattr(WatchedCatalog, _name, _dirtying(_name))
+
+
+class PristineTranslation(object):
+    """A translation, along with what it and its fallbacks looked like when
+    they were freshly loaded."""
+
+    def __init__(self, translation):
+        self.translation = translation
+        self.chain = []
+        obj = translation
+        while obj is not None and hasattr(obj, '_catalog'):
+            pristine = dict(obj._catalog)
+            obj._catalog = WatchedCatalog(pristine)
+            fallback = getattr(obj, '_fallback', None)
+            self.chain.append((obj, pristine, fallback))
+            obj = fallback
+
+    def restore(self):
+        """Undo any changes made since the translation was loaded."""
+        for obj, pristine, fallback in self.chain:
+            if (not isinstance(obj._catalog, WatchedCatalog) or
+                obj._catalog.dirty or
+                getattr(obj, '_fallback', None) is not fallback):
+                obj._catalog = WatchedCatalog(pristine)
+                obj._fallback = fallback
+
+
+# Language -> PristineTranslation, for every language loaded this process:
+_pristine = {}
+
+# What trans_real._default was before any test ran:
+_UNSET = object()
+_default = _UNSET
+
+
+def _adopt(language):
+    """Load ``language`` freshly, and keep it (and any languages loaded along
+    with it) pristine."""
+    in_use = trans_real._translations
+    trans_real._translations = {}
+    try:
+        trans_real.translation(language)
+        fresh = trans_real._translations
+    finally:
+        trans_real._translations = in_use
+    for lang, translation in fresh.items():
+        if lang not in _pristine:
+            _pristine[lang] = PristineTranslation(translation)
+
+
+def reset_translations():
+    """Put translation state back how it was when the catalogs were loaded,
+    and activate ``settings.LANGUAGE_CODE``."""
+    global _default
+    if _default is _UNSET:
+        _default = trans_real._default
+    trans_real.deactivate()
+
+    # Languages loaded by the last test may have been modified by it since,
+    # so we load our own copies:
+    for language in list(trans_real._translations):
+        if language not in _pristine:
+            _adopt(language)
+
+    for pristine in _pristine.values():
+        pristine.restore()
+    trans_real._translations = dict((lang, p.translation)
+                                    for lang, p in _pristine.items())
+    trans_real._default = _default
+    trans_real.activate(settings.LANGUAGE_CODE)
@@ -0,0 +1,174 @@
+"""Empty a bunch of tables as quickly as each DB backend allows.
+
+This is shared by all the teardown paths. The strategies:
+
+* Tables which are already empty are left alone. (One query finds out.)
+* PostgreSQL gets a single ``TRUNCATE ... RESTART IDENTITY`` of the tables,
+  empty or not, which no table outside the list has a foreign key to, since
+  it won't truncate a table without the tables pointing at it. (``CASCADE``
+  would quietly empty those too, even ones we were told to keep.) The
+  others get a ``DELETE``; Django's foreign keys there are deferred anyway.
+* SQLite gets a ``DELETE`` per table, all in one transaction with foreign key
+  enforcement off, or, inside a managed transaction where that can't be
+  changed, deferred to its commit.
+* MySQL gets ``TRUNCATE`` for big tables and ``DELETE`` for small ones, since
+  ``TRUNCATE`` is really a drop-and-recreate and is slower on small tables.
+  ``DELETE`` doesn't reset ``AUTO_INCREMENT``, so the small tables whose
+  counter has moved get an ``ALTER TABLE`` afterward, all together.
+  Foreign key checks are off throughout.
+
+Anything else gets a plain ``DELETE`` per table.
+
+The "big table" threshold, in rows, is the ``TEST_UTILS_TRUNCATE_THRESHOLD``
+setting.
+
+"""
+from django.conf import settings
+from django.db import transaction
+
+
+# Max number of tables to count rows in with a single query:
+COUNT_BATCH_SIZE = 100
+
+
+def backend_name(connection):
+    """Return 'mysql', 'postgresql', 'sqlite', or None for other backends."""
+    engine = connection.settings_dict['ENGINE']
+    for name in ('mysql', 'postgresql', 'sqlite'):
+        if name in engine:
+            return name
+    return None
+
+
+def row_counts(connection, tables, cap):
+    """Return a dict of the number of rows in each table, counting no higher
+    than ``cap`` so big tables don't cost a full scan."""
+    qn = connection.ops.quote_name
+    counts = {}
+    tables = list(tables)
+    cursor = connection.cursor()
+    for start in xrange(0, len(tables), COUNT_BATCH_SIZE):
+        batch = tables[start:start + COUNT_BATCH_SIZE]
+        cursor.execute(' UNION ALL '.join(
+            'SELECT %%s, COUNT(*) FROM (SELECT 1 FROM %s LIMIT %d) t%d' %
+            (qn(table), cap, i) for i, table in enumerate(batch)), batch)
+        counts.update(cursor.fetchall())
+    return counts
+
+
+def _referencing_tables(cursor, tables):
+    """Return {table: tables with foreign keys to it} for PostgreSQL."""
+    tables = sorted(tables)
+    cursor.execute(
+        'SELECT target.relname, source.relname FROM pg_constraint c '
+        'JOIN pg_class source ON source.oid = c.conrelid '
+        'JOIN pg_class target ON target.oid = c.confrelid '
+        "WHERE c.contype = 'f' AND pg_table_is_visible(target.oid) "
+        'AND target.relname IN (%s)' % ', '.join(['%s'] * len(tables)),
+        tables)
+    referencing = {}
+    for target, source in cursor.fetchall():
+        referencing.setdefault(target, set()).add(source)
+    return referencing
+
+
+def _truncate_postgresql(connection, cursor, tables, counts, threshold):
+    qn = connection.ops.quote_name
+    referencing = _referencing_tables(cursor, tables)
+    # Drop tables pointed at from outside the set until nothing is:
+    closed = set(tables)
+    while True:
+        outside = set(t for t in closed
+                      if referencing.get(t, set()) - closed)
+        if not outside:
+            break
+        closed -= outside
+    if closed & set(counts):
+        cursor.execute('TRUNCATE %s RESTART IDENTITY' %
+                       ', '.join(qn(table) for table in sorted(closed)))
+    for table in sorted(set(counts) - closed):
+        cursor.execute('DELETE FROM %s' % qn(table))
+
+
+def _truncate_sqlite(connection, cursor, tables, counts, threshold):
+    qn = connection.ops.quote_name
+    cursor.execute('PRAGMA foreign_keys')
+    enforcing = cursor.fetchone()[0]
+    # Turning enforcement off has no effect inside a transaction, so do that
+    # only when we're about to start one, and otherwise put the checks off
+    # until the transaction commits:
+    managed = transaction.is_managed(using=connection.alias)
+    if enforcing:
+        cursor.execute('PRAGMA defer_foreign_keys=ON' if managed else
+                       'PRAGMA foreign_keys=OFF')
+    for table in counts:
+        cursor.execute('DELETE FROM %s' % qn(table))
+    if enforcing and not managed:
+        # Commit the DELETEs first, or this is ignored too.
+        transaction.commit_unless_managed(using=connection.alias)
+        cursor.execute('PRAGMA foreign_keys=ON')
+
+
+def _moved_counters(cursor, tables):
+    """Return which of MySQL's ``tables`` will hand out an ID past 1."""
+    tables = sorted(tables)
+    cursor.execute('SELECT TABLE_NAME FROM information_schema.TABLES '
+                   'WHERE TABLE_SCHEMA = DATABASE() AND AUTO_INCREMENT > 1 '
+                   'AND TABLE_NAME IN (%s)' % ', '.join(['%s'] * len(tables)),
+                   tables)
+    return [table for (table,) in cursor.fetchall()]
+
+
+def _truncate_mysql(connection, cursor, tables, counts, threshold):
+    qn = connection.ops.quote_name
+    cursor.execute('SET FOREIGN_KEY_CHECKS=0')
+    small = []
+    for table, count in counts.iteritems():
+        if count > threshold:
+            # Truncate implicitly commits.
+            cursor.execute('TRUNCATE %s' % qn(table))
+        else:
+            cursor.execute('DELETE FROM %s' % qn(table))
+            small.append(table)
+    # Start counting from 1 again, as TRUNCATE would. Each ALTER commits, so
+    # they all come last, and only where the counter moved:
+    if small:
+        for table in _moved_counters(cursor, small):
+            cursor.execute('ALTER TABLE %s AUTO_INCREMENT = 1' % qn(table))
+    cursor.execute('SET FOREIGN_KEY_CHECKS=1')
+
+
+def _truncate_other(connection, cursor, tables, counts, threshold):
+    qn = connection.ops.quote_name
+    for table in counts:
+        cursor.execute('DELETE FROM %s' % qn(table))
+
+
+_strategies = {
+    'postgresql': _truncate_postgresql,
+    'sqlite': _truncate_sqlite,
+    'mysql': _truncate_mysql,
+}
+
+
+def truncate_tables(connection, tables):
+    """Empty ``tables`` on ``connection``, and commit unless the transaction
+    is managed.
+
+    Return the number of tables which actually had rows to remove.
+
+    """
+    tables = set(tables)
+    if not tables:
+        return 0
+    threshold = getattr(settings, 'TEST_UTILS_TRUNCATE_THRESHOLD', 1000)
+    counts = dict((table, count) for table, count in
+                  row_counts(connection, tables, threshold + 1).iteritems()
+                  if count)
+    if counts:
+        strategy = _strategies.get(backend_name(connection), _truncate_other)
+        cursor = connection.cursor()
+        strategy(connection, cursor, tables, counts, threshold)
+        cursor.close()
+    transaction.commit_unless_managed(using=connection.alias)
+    return len(counts)